@@ -0,0 +1,351 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is reported as null there
+    resource = None
+
+from build_report import get_cpu_seconds
+from update_repo import STANDARD_PLATFORMS
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Phases run in this order on the same tree, each in its own process so peak RSS
+# and I/O counters belong to that phase alone
+PHASES = ["create_zip", "generate_repo_cold", "generate_repo_warm", "create_directory_indices"]
+
+# Unversioned source addon used by the create_zip phase. Dot-prefixed, so generate_repo skips it.
+SOURCE_ADDON_DIR = ".bench-source"
+SOURCE_ZIP = ".bench-source.zip"
+
+REPORT_VERSION = 1
+
+ADDON_XML_TEMPLATE = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<addon id="{addon_id}" name="Benchmark addon {number}" version="{version}" provider-name="benchmark">
+    <requires>
+        <import addon="xbmc.python" version="3.0.0"/>
+    </requires>
+    <extension point="xbmc.python.pluginsource" library="default.py">
+        <provides>video</provides>
+    </extension>
+    <extension point="xbmc.addon.metadata">
+        <summary lang="en_GB">Synthetic addon {number}</summary>
+        <description lang="en_GB">Generated by benchmark.py</description>
+        <platform>{platform}</platform>
+        <assets>
+            <icon>resources/icon.png</icon>
+            <fanart>resources/fanart.jpg</fanart>
+        </assets>
+    </extension>
+</addon>
+"""
+
+WORDS = ["def", "return", "self", "addon", "xbmc", "import", "listitem", "url", "path", "if", "else", "for", "in", "None", "True", "json", "info", "video"]
+
+
+def make_source_blob(rng, size):
+    """Compressible, source code like text of roughly size bytes."""
+    lines = []
+    length = 0
+    while length < size:
+        line = "    " * rng.randint(0, 3) + " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 10))) + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode("utf-8")[:size]
+
+
+def build_addon_entries(addon_id, number, version, platform_name, entries, blobs, image):
+    """Archive name -> bytes for one synthetic addon zip with `entries` files in total."""
+    files = {
+        "addon.xml": ADDON_XML_TEMPLATE.format(addon_id=addon_id, number=number, version=version, platform=platform_name).encode("utf-8"),
+        "resources/icon.png": image,
+        "resources/fanart.jpg": image,
+    }
+    for i in range(max(0, entries - len(files))):
+        header = f"# {addon_id} {version} {i}\n".encode("utf-8")
+        files[f"resources/lib/module_{i:04d}.py"] = header + blobs[i % len(blobs)]
+    return {f"{addon_id}/{name}": data for name, data in files.items()}
+
+
+def build_synthetic_repo(root, addons, versions, binary_addons, platforms, entries, entry_size, image_size, seed=0):
+    """
+    Creates a repository tree in root the way update_repo.py leaves it: one directory per
+    addon holding `versions` zips, or `platforms` zips per version for the first
+    `binary_addons` addons, plus the repository addon.xml, icon and mirrors from this checkout.
+    Returns a summary of what was created.
+    """
+    rng = random.Random(seed)
+    blobs = [make_source_blob(rng, entry_size) for _ in range(16)]
+    # Images are incompressible, like real icons and fanart
+    image = bytes(rng.getrandbits(8) for _ in range(image_size))
+    platform_names = STANDARD_PLATFORMS[:platforms]
+
+    os.makedirs(root, exist_ok=True)
+    for name in ("addon.xml", "icon.jpg", "mirrors.json"):
+        if os.path.exists(os.path.join(SCRIPT_DIR, name)):
+            shutil.copyfile(os.path.join(SCRIPT_DIR, name), os.path.join(root, name))
+
+    zip_count = 0
+    total_bytes = 0
+    for number in range(addons):
+        addon_id = f"plugin.video.bench{number:04d}"
+        addon_dir = os.path.join(root, addon_id)
+        os.makedirs(addon_dir, exist_ok=True)
+        binary = number < binary_addons and platform_names
+
+        for v in range(versions):
+            version = f"1.0.{v}"
+            targets = [(p, f"{addon_id}-{version}-{p}.zip") for p in platform_names] if binary else [("all", f"{addon_id}-{version}.zip")]
+            for platform_name, zip_name in targets:
+                zip_path = os.path.join(addon_dir, zip_name)
+                with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+                    for arcname, data in build_addon_entries(addon_id, number, version, platform_name, entries, blobs, image).items():
+                        zf.writestr(arcname, data)
+                zip_count += 1
+                total_bytes += os.path.getsize(zip_path)
+
+    # Plain source tree for the create_zip phase
+    source_dir = os.path.join(root, SOURCE_ADDON_DIR)
+    for arcname, data in build_addon_entries("plugin.video.benchsource", 0, "1.0.0", "all", entries, blobs, image).items():
+        path = os.path.join(source_dir, *arcname.split("/")[1:])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    return {"addons": addons, "zips": zip_count, "zip_bytes": total_bytes}
+
+
+def read_io_counters():
+    """
+    Bytes passed through read() and write() calls by this process and its reaped children,
+    from /proc/self/io. Linux only, (None, None) elsewhere.
+    Reads served from a memory map are not system calls and therefore not counted.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ", 1) for line in f.read().splitlines() if ": " in line)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def get_peak_rss_kb():
+    """Peak resident set size in KB of this process or any of its reaped worker processes."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in KB everywhere else
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_phase(phase, root, jobs):
+    """Runs one phase in root and returns its measurements. Called in a fresh process."""
+    os.chdir(root)
+    sys.path.insert(0, SCRIPT_DIR)
+    import generate_repo
+    import create_directory_indices
+
+    if phase == "create_zip":
+        # build_zip skips zips that are already up to date, so always start from scratch
+        if os.path.exists(SOURCE_ZIP):
+            os.remove(SOURCE_ZIP)
+        action = lambda: generate_repo.create_zip(SOURCE_ADDON_DIR, SOURCE_ZIP)
+    elif phase == "generate_repo_cold":
+        if os.path.exists(generate_repo.BUILD_CACHE_FILE):
+            os.remove(generate_repo.BUILD_CACHE_FILE)
+        action = lambda: generate_repo.generate_repo(jobs=jobs)
+    elif phase == "generate_repo_warm":
+        action = lambda: generate_repo.generate_repo(jobs=jobs)
+    elif phase == "create_directory_indices":
+        action = create_directory_indices.create_directory_indices
+    else:
+        raise ValueError(f"Unknown phase {phase}")
+
+    read_start, written_start = read_io_counters()
+    cpu_start = get_cpu_seconds()
+    wall_start = time.perf_counter()
+
+    # The scripts report every file they touch, which would only measure the terminal
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        action()
+
+    wall = time.perf_counter() - wall_start
+    cpu = get_cpu_seconds() - cpu_start
+    read_end, written_end = read_io_counters()
+
+    return {
+        "wall_s": round(wall, 6),
+        "cpu_s": round(cpu, 6),
+        "peak_rss_kb": get_peak_rss_kb(),
+        "bytes_read": None if read_start is None else read_end - read_start,
+        "bytes_written": None if written_start is None else written_end - written_start,
+    }
+
+
+def run_phase_process(phase, root, jobs):
+    """Runs a phase in a child interpreter and returns its measurements."""
+    fd, result_path = tempfile.mkstemp(prefix="bench-", suffix=".json")
+    os.close(fd)
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), "--run-phase", phase, "--root", root, "--jobs", str(jobs), "--result", result_path]
+        subprocess.run(cmd, check=True)
+        with open(result_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+
+def summarize(runs):
+    """Median per phase over all runs, peak RSS as the maximum."""
+    summary = {}
+    for phase in PHASES:
+        samples = [run[phase] for run in runs if phase in run]
+        if not samples:
+            continue
+        phase_summary = {}
+        for key in samples[0]:
+            values = [s[key] for s in samples if s[key] is not None]
+            if not values:
+                phase_summary[key] = None
+            elif key == "peak_rss_kb":
+                phase_summary[key] = max(values)
+            elif key.endswith("_s"):
+                phase_summary[key] = round(statistics.median(values), 6)
+            else:
+                phase_summary[key] = int(statistics.median(values))
+        summary[phase] = phase_summary
+    return summary
+
+
+def get_git_revision():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=SCRIPT_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+
+def compare_reports(baseline, report):
+    """Prints the change of every phase metric relative to a baseline report."""
+    print(f"Compared with {baseline.get('revision') or 'baseline'}:")
+    for phase, metrics in report["phases"].items():
+        old_metrics = baseline.get("phases", {}).get(phase)
+        if not old_metrics:
+            print(f"  {phase}: not in baseline")
+            continue
+        changes = []
+        for key, value in metrics.items():
+            old = old_metrics.get(key)
+            if value is None or not old:
+                continue
+            changes.append(f"{key} {(value - old) / old * 100:+.1f}%")
+        print(f"  {phase}: {', '.join(changes)}")
+
+
+def run_benchmark(args):
+    params = {
+        "addons": args.addons,
+        "versions": args.versions,
+        "binary_addons": args.binary_addons,
+        "platforms": args.platforms,
+        "entries": args.entries,
+        "entry_size": args.entry_size,
+        "image_size": args.image_size,
+        "jobs": args.jobs,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+    runs = []
+    tree = None
+    for run in range(args.repeat):
+        # Every run starts from a fresh tree, so the cold phase really is cold
+        root = tempfile.mkdtemp(prefix="repo-bench-")
+        try:
+            tree_start = time.perf_counter()
+            tree = build_synthetic_repo(root, args.addons, args.versions, args.binary_addons, args.platforms,
+                                        args.entries, args.entry_size, args.image_size, args.seed)
+            print(f"Run {run + 1}/{args.repeat}: built {tree['zips']} zips ({tree['zip_bytes']} bytes) in {time.perf_counter() - tree_start:.2f}s")
+
+            results = {}
+            for phase in PHASES:
+                results[phase] = run_phase_process(phase, root, args.jobs)
+                print(f"  {phase}: {results[phase]['wall_s']:.3f}s wall, {results[phase]['cpu_s']:.3f}s CPU, peak RSS {results[phase]['peak_rss_kb']} KB")
+            runs.append(results)
+        finally:
+            if args.keep_tree:
+                print(f"Kept tree in {root}")
+            else:
+                shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "version": REPORT_VERSION,
+        "revision": get_git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "tree": tree,
+        "phases": summarize(runs),
+        "runs": runs,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare_reports(json.load(f), report)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark generate_repo.py and create_directory_indices.py on synthetic repository trees")
+    parser.add_argument("--addons", type=int, default=50, metavar="N", help="number of addon directories (default: 50)")
+    parser.add_argument("--versions", type=int, default=3, metavar="N", help="versions per addon (default: 3)")
+    parser.add_argument("--binary-addons", type=int, default=5, metavar="N", help="how many of the addons have platform zips (default: 5)")
+    parser.add_argument("--platforms", type=int, default=len(STANDARD_PLATFORMS), metavar="N",
+                        help=f"platform zips per version of a binary addon, taken from STANDARD_PLATFORMS (default: {len(STANDARD_PLATFORMS)})")
+    parser.add_argument("--entries", type=int, default=40, metavar="N", help="files per zip, including addon.xml and two images (default: 40)")
+    parser.add_argument("--entry-size", type=int, default=8192, metavar="BYTES", help="size of each source file (default: 8192)")
+    parser.add_argument("--image-size", type=int, default=32768, metavar="BYTES", help="size of icon and fanart (default: 32768)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, metavar="N", help="passed to generate_repo (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3, metavar="N", help="number of runs, the report holds the medians (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic content")
+    parser.add_argument("--output", "-o", metavar="FILE", help="write the JSON report to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="print the change relative to an earlier JSON report")
+    parser.add_argument("--keep-tree", action="store_true", help="do not delete the synthetic trees")
+    # Used internally to run a single phase in a child process
+    parser.add_argument("--run-phase", choices=PHASES, help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_phase:
+        result = run_phase(args.run_phase, args.root, args.jobs)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+    else:
+        if args.repeat < 1 or args.platforms > len(STANDARD_PLATFORMS):
+            parser.error(f"--repeat must be at least 1 and --platforms at most {len(STANDARD_PLATFORMS)}")
+        run_benchmark(args)
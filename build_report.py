@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import collections
+
+# Process wide counters, e.g. zips opened and bytes inflated or written. The code doing
+# the work adds to them with count(), a BuildReport takes the totals of its run.
+# Worker processes have their own copy and hand back their deltas with their results.
+COUNTERS = collections.Counter()
+_counters_lock = threading.Lock()
+
+
+def count(name, n=1):
+    with _counters_lock:
+        COUNTERS[name] += n
+
+
+def snapshot_counters():
+    with _counters_lock:
+        return dict(COUNTERS)
+
+
+def counters_since(snapshot):
+    """Counters that changed since snapshot_counters() returned snapshot, with their increase."""
+    with _counters_lock:
+        return {name: value - snapshot.get(name, 0) for name, value in COUNTERS.items() if value != snapshot.get(name, 0)}
+
+
+def get_cpu_seconds():
+    """User and system time of this process and its reaped children, e.g. pool workers."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class BuildReport:
+    """
+    Wall and CPU time per phase and per item (addon directory or release repo) of one run,
+    plus the counters collected while it ran. Written as JSON with --report.
+    """
+
+    def __init__(self, script):
+        self.script = script
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        self.phases = {}
+        self.items = {}
+        # Counters that were not collected in this process, e.g. from pool workers
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+        self._start_counters = snapshot_counters()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = get_cpu_seconds()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Adds the time spent in the with block to phase name."""
+        wall = time.perf_counter()
+        cpu = get_cpu_seconds()
+        try:
+            yield
+        finally:
+            entry = self.phases.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0})
+            entry["wall_s"] = round(entry["wall_s"] + time.perf_counter() - wall, 6)
+            entry["cpu_s"] = round(entry["cpu_s"] + get_cpu_seconds() - cpu, 6)
+
+    def add_item(self, name, stats):
+        with self._lock:
+            self.items[name] = stats
+
+    def merge_counters(self, counters):
+        with self._lock:
+            self.counters.update(counters)
+
+    def to_dict(self):
+        counters = collections.Counter(counters_since(self._start_counters))
+        counters.update(self.counters)
+        return {
+            "script": self.script,
+            "started": self.started,
+            "wall_s": round(time.perf_counter() - self._start_wall, 6),
+            "cpu_s": round(get_cpu_seconds() - self._start_cpu, 6),
+            "phases": self.phases,
+            "counters": dict(sorted(counters.items())),
+            "items": self.items,
+        }
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1, ensure_ascii=False)
+            f.write("\n")
+        print(f"Wrote build report to {path}")
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """Runs the with block under cProfile and dumps the stats to path. Does nothing without a path."""
+    if not path:
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Wrote profile to {path} (worker processes are not included)")
@@ -0,0 +1,139 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from build_report import count
+from publish import write_json_atomic
+from repo_scan import scan_directory
+
+# sha256 of published files, keyed by the path they are published under and validated by
+# size and mtime, so unchanged zips are hashed once and not on every run
+HASH_CACHE_FILE = ".hash-cache.json"
+HASH_CACHE_VERSION = 1
+
+# Extension of the per-zip checksum files Kodi fetches when the repository sets <hashes>sha256</hashes>
+SIDECAR_EXTENSION = ".sha256"
+
+
+def get_file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """
+    Cached sha256 of files. Only entries looked up since it was loaded are saved,
+    so files that were deleted drop out.
+    """
+
+    def __init__(self, cache_path=HASH_CACHE_FILE):
+        self.cache_path = cache_path
+        self.files = {}
+        self.used = {}
+        if cache_path:
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    cache = json.load(f)
+                if cache.get("version") == HASH_CACHE_VERSION:
+                    self.files = cache["files"]
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def get(self, key, path=None, file_entry=None):
+        """
+        sha256 of the file at path (default: key), from the cache if its size and mtime are unchanged.
+        key is the path the file is published under. Staged files keep their mtime when
+        they are moved into place, so their entry stays valid after the commit.
+        file_entry is the repo_scan.FileEntry of the file, which saves the stat.
+        """
+        if file_entry is None:
+            st = os.stat(path or key)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        else:
+            size, mtime_ns = file_entry.size, file_entry.mtime_ns
+        cached = self.used.get(key) or self.files.get(key)
+        if cached and cached[0] == size and cached[1] == mtime_ns:
+            sha256 = cached[2]
+        else:
+            sha256 = get_file_sha256(path or key)
+            count("files_hashed")
+            count("bytes_hashed", size)
+        self.used[key] = [size, mtime_ns, sha256]
+        return sha256
+
+    def get_many(self, files, workers=None, file_entries=None):
+        """
+        sha256 of many files at once, as key -> sha256. files maps key -> path,
+        file_entries key -> repo_scan.FileEntry for the files that were scanned.
+        Cache misses are hashed in a thread pool, hashlib releases the GIL on large buffers.
+        """
+        file_entries = file_entries or {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            keys = list(files)
+            return dict(zip(keys, executor.map(lambda key: self.get(key, files[key], file_entries.get(key)), keys)))
+
+    def save(self, prune=True):
+        """Writes the entries looked up since loading, and with prune=False also the others."""
+        if not self.cache_path:
+            return
+        files = self.used if prune else dict(self.files, **self.used)
+        write_json_atomic(self.cache_path, {"version": HASH_CACHE_VERSION, "files": files})
+
+
+def format_sidecar(sha256, filename):
+    # sha256sum format. Kodi only reads up to the first whitespace.
+    return f"{sha256}  {filename}\n"
+
+
+def publish_zip_sidecars(publisher, hash_cache, directories, workers=None, scan=None):
+    """
+    Stages a .sha256 file next to every zip in directories, including zips staged by
+    the publisher. Zips are hashed in parallel and unchanged sidecars are not rewritten.
+    The directories are taken from scan (a repo_scan.RepositoryScan) if given.
+    Returns the number of sidecars that changed.
+    """
+    zips = {}
+    file_entries = {}
+    for d in directories:
+        names = {}
+        listing = scan.get(d) if scan else scan_directory(d)
+        for name, file_entry in listing.files.items():
+            if name.endswith(".zip"):
+                names[name] = os.path.join(d, name)
+                file_entries[os.path.normpath(os.path.join(d, name))] = file_entry
+        for name, temp_path in publisher.staged_files(d).items():
+            if name.endswith(".zip"):
+                names[name] = temp_path
+        for name, path in names.items():
+            key = os.path.normpath(os.path.join(d, name))
+            zips[key] = path
+            if path != os.path.join(d, name):
+                # Staged, the scanned entry is the file it replaces
+                file_entries.pop(key, None)
+
+    changed = 0
+    for key, sha256 in sorted(hash_cache.get_many(zips, workers, file_entries).items()):
+        if publisher.write_if_changed(key + SIDECAR_EXTENSION, format_sidecar(sha256, os.path.basename(key)).encode("utf-8")):
+            changed += 1
+    return changed
+
+
+def remove_orphaned_sidecars(directories, publisher=None, scan=None):
+    """
+    Deletes .sha256 files whose zip no longer exists, e.g. after prune_versions.py.
+    With a publisher, zips staged by it count as existing. With scan (a
+    repo_scan.RepositoryScan) the directories are taken from it and kept up to date.
+    """
+    exists = publisher.exists if publisher else os.path.exists
+    for d in directories:
+        listing = scan.get(d) if scan else scan_directory(d)
+        for name in list(listing.files):
+            path = os.path.join(d, name)
+            if name.endswith(".zip" + SIDECAR_EXTENSION) and not exists(path[:-len(SIDECAR_EXTENSION)]):
+                os.remove(path)
+                listing.remove(name)
+                print(f"Removed orphaned checksum {path}")
@@ -1,18 +1,34 @@
 import os
+import json
 
-def create_directory_indices():
-    # Get all directories in current path
-    dirs = [d for d in os.listdir('.') if os.path.isdir(d) and not d.startswith('.') and d != '__pycache__']
-    dirs.sort()
+from checksums import HashCache
+from publish import Publisher
+from repo_scan import parse_zip_filename, scan_directory, scan_repository
 
-    for d in dirs:
-        # Check if it looks like an addon directory (has addon.xml or zip files)
-        # We can be loose here and just generate index for all subdirectories just in case
-        files = [f for f in os.listdir(d) if not f.startswith('.') and f != 'index.html' and f != '__pycache__']
-        files.sort()
-        
-        # Simple HTML template compatible with Kodi HTTP dictionary scraping
-        html = """<!DOCTYPE html>
+# Written by this script, never listed
+INDEX_FILES = ('index.html', 'index.json')
+
+def list_directory(publisher, d, listing):
+    """
+    Entries of directory d, including files staged by the publisher, as
+    name -> (is_dir, path to read the current content from, FileEntry or None).
+    listing is the repo_scan.DirectoryListing of d. Staged files have no FileEntry,
+    the scanned one belongs to the file they replace.
+    """
+    entries = {}
+    for name in listing.subdirs:
+        entries[name] = (True, os.path.join(d, name), None)
+    for name, file_entry in listing.files.items():
+        if name not in INDEX_FILES:
+            entries[name] = (False, os.path.join(d, name), file_entry)
+    for name, temp_path in publisher.staged_files(d).items():
+        if not name.startswith('.') and name not in INDEX_FILES:
+            entries[name] = (False, temp_path, None)
+    return entries
+
+def render_index_html(d, listing):
+    # Simple HTML template compatible with Kodi HTTP dictionary scraping
+    html = """<!DOCTYPE html>
 <html>
 <head>
 <title>Index of /%s</title>
@@ -21,38 +37,84 @@ def create_directory_indices():
 <h1>Index of /%s</h1>
 <hr><pre>
 """ % (d, d)
-        
-        # Add parent link
-        html += '<a href="../">../</a>\n'
-        
-        for f in files:
-            # Check if directory
-            is_dir = os.path.isdir(os.path.join(d, f))
-            display_name = f + "/" if is_dir else f
-            
-            # Simple alignment
-            space_len = 50 - len(display_name)
-            space = " " * space_len if space_len > 0 else " "
-            
-            # Get size for files
-            if not is_dir:
-                try:
-                    size = os.path.getsize(os.path.join(d, f))
-                except:
-                    size = 0
-                size_str = str(size)
-            else:
-                size_str = "-"
-            
-            html += f'<a href="{display_name}">{display_name}</a>{space}{size_str}\n'
-            
-        html += """</pre><hr></body>
+
+    # Add parent link
+    html += '<a href="../">../</a>\n'
+
+    for item in listing:
+        display_name = item["name"]
+
+        # Simple alignment
+        space_len = 50 - len(display_name)
+        space = " " * space_len if space_len > 0 else " "
+
+        size_str = "-" if item["size"] is None else str(item["size"])
+        html += f'<a href="{display_name}">{display_name}</a>{space}{size_str}\n'
+
+    html += """</pre><hr></body>
 </html>
 """
-        
-        with open(os.path.join(d, 'index.html'), 'w', encoding='utf-8') as f:
-            f.write(html)
+    return html
+
+def create_directory_indices(publisher=None, hash_cache=None, directories=None, scan=None):
+    """
+    Writes an index.html and an index.json (name, size, sha256 and version of every entry)
+    for every top level directory, or only for directories if given.
+    The directories are listed from scan (a repo_scan.RepositoryScan), scanned here if not given.
+    Pages whose content did not change are left alone.
+    With a publisher (see publish.py) the pages are staged and files staged by the same
+    build are listed as well; without one the pages are published when this returns.
+    hash_cache is shared with the caller, which then saves it; by default the
+    .hash-cache.json is loaded and saved here.
+    """
+    if publisher is None:
+        with Publisher() as publisher:
+            create_directory_indices(publisher, hash_cache, directories, scan)
+        return
+
+    own_cache = hash_cache is None
+    if own_cache:
+        hash_cache = HashCache()
+    updated = 0
+    unchanged = 0
+
+    # Get all directories in current path
+    if scan is None and directories is None:
+        scan = scan_repository()
+    dirs = list(scan.dirs) if directories is None else sorted(directories)
+
+    for d in dirs:
+        # We can be loose here and just generate index for all subdirectories just in case
+        entries = list_directory(publisher, d, scan.dirs[d] if scan and d in scan.dirs else scan_directory(d))
+
+        listing = []
+        for name in sorted(entries):
+            is_dir, path, file_entry = entries[name]
+            if is_dir:
+                listing.append({"name": name + "/", "size": None, "sha256": None, "version": None})
+                continue
+            try:
+                size = os.path.getsize(path) if file_entry is None else file_entry.size
+                sha256 = hash_cache.get(os.path.join(d, name), path, file_entry)
+            except OSError:
+                size = 0
+                sha256 = None
+            parsed = parse_zip_filename(name) if name.endswith('.zip') else None
+            listing.append({"name": name, "size": size, "sha256": sha256, "version": parsed[1] if parsed else None})
+
+        html_changed = publisher.write_if_changed(os.path.join(d, 'index.html'), render_index_html(d, listing).encode("utf-8"))
+        index_json = json.dumps({"directory": d, "entries": listing}, indent=1, ensure_ascii=False) + "\n"
+        json_changed = publisher.write_if_changed(os.path.join(d, 'index.json'), index_json.encode("utf-8"))
+
+        if html_changed or json_changed:
+            updated += 1
             print(f"Created index.html for {d}")
+        else:
+            unchanged += 1
+
+    if own_cache:
+        hash_cache.save()
+    print(f"Directory indices: {updated} updated, {unchanged} unchanged")
 
 if __name__ == '__main__':
     create_directory_indices()
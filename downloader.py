@@ -0,0 +1,190 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from build_report import count
+
+# Bytes per read from the response and per write to the .part file
+CHUNK_SIZE = 1024 * 1024
+# Assets of at least PARALLEL_MIN_SIZE are fetched as up to DEFAULT_PARTS ranges in parallel
+PARALLEL_MIN_SIZE = 8 * 1024 * 1024
+DEFAULT_PARTS = 4
+RETRIES = 4
+TIMEOUT = 30
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RangesNotSupported(DownloadError):
+    pass
+
+
+def get_partial_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def parse_digest(digest):
+    """Splits a release asset digest like "sha256:ab12..." into (algorithm, hexdigest), or (None, None)."""
+    if not digest or ":" not in digest:
+        return None, None
+    algorithm, _, value = digest.partition(":")
+    algorithm = algorithm.lower()
+    if algorithm not in hashlib.algorithms_available:
+        return None, None
+    return algorithm, value.lower()
+
+
+def get_file_digest(path, algorithm):
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fetch_range(session, url, path, start, end=None, headers=None):
+    """
+    Appends bytes start..end (inclusive, end None = to the end) of url to path, resuming
+    from what path already holds. Raises RangesNotSupported if the server ignores Range
+    for a request that doesn't start at 0.
+    """
+    offset = start + get_partial_size(path)
+    if end is not None and offset > end:
+        return
+
+    request_headers = dict(headers or {})
+    if offset > 0 or end is not None:
+        request_headers["Range"] = f"bytes={offset}-{'' if end is None else end}"
+
+    with session.get(url, headers=request_headers, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 416 and end is None:
+            # Everything is there already
+            return
+        response.raise_for_status()
+
+        mode = "ab"
+        if "Range" in request_headers and response.status_code != 206:
+            if start > 0 or end is not None:
+                raise RangesNotSupported(f"{url} does not support range requests")
+            # Full content instead of the missing tail, start over
+            mode = "wb"
+        elif response.status_code == 206 and not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+            raise DownloadError(f"Unexpected Content-Range {response.headers.get('Content-Range')} for {url}")
+
+        with open(path, mode) as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                count("bytes_fetched", len(chunk))
+
+
+def with_retries(action, retries, log, description):
+    """Calls action() until it succeeds, retrying network errors with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return action()
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries:
+                raise DownloadError(f"{description} failed after {retries + 1} attempts: {e}") from e
+            delay = 2 ** attempt
+            log(f"{description} interrupted ({e.__class__.__name__}), resuming in {delay}s")
+            time.sleep(delay)
+
+
+def download_parallel(url, part_path, size, parts, headers, retries, log):
+    """
+    Fetches size bytes as `parts` ranges into part_path.0, part_path.1, ... in parallel,
+    each resumable on its own, then joins them into part_path.
+    """
+    part_size = -(-size // parts)
+    ranges = [(i * part_size, min(size, (i + 1) * part_size) - 1) for i in range(parts)]
+    local = threading.local()
+
+    def fetch(index):
+        # requests sessions should not be shared between threads
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start, end = ranges[index]
+        chunk_path = f"{part_path}.{index}"
+        # fetch_range resumes from the chunk file's length, which counts from `start`
+        with_retries(lambda: fetch_range(local.session, url, chunk_path, start, end, headers), retries, log,
+                     f"Range {start}-{end} of {os.path.basename(part_path)}")
+
+    with ThreadPoolExecutor(max_workers=parts) as executor:
+        list(executor.map(fetch, range(parts)))
+
+    with open(part_path, "wb") as out:
+        for index in range(parts):
+            chunk_path = f"{part_path}.{index}"
+            with open(chunk_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    out.write(chunk)
+    for index in range(parts):
+        os.remove(f"{part_path}.{index}")
+
+
+def remove_partial(part_path, parts):
+    for path in [part_path] + [f"{part_path}.{index}" for index in range(parts)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download_file(url, dest, size=None, digest=None, parts=DEFAULT_PARTS, headers=None, retries=RETRIES, log=print):
+    """
+    Downloads url to dest through dest + ".part", which is renamed to dest only after its
+    size and digest ("sha256:<hex>" as in GitHub release metadata) have been verified.
+    An interrupted download is resumed with an HTTP Range request, as is a .part file an
+    earlier call left at dest (update_repo.py downloads into a new temp directory per run,
+    so there it only resumes within a run). Assets of known size of at least
+    PARALLEL_MIN_SIZE are fetched as `parts` ranges in parallel when the server supports it.
+    Returns a dict with the number of bytes, where it resumed and how many parts were used.
+    """
+    part_path = dest + ".part"
+    algorithm, expected_digest = parse_digest(digest)
+    resumed_from = get_partial_size(part_path)
+    start = time.perf_counter()
+
+    if size is not None and resumed_from > size:
+        os.remove(part_path)
+        resumed_from = 0
+
+    used_parts = 1
+    if parts > 1 and size is not None and size >= PARALLEL_MIN_SIZE and resumed_from == 0:
+        try:
+            download_parallel(url, part_path, size, parts, headers, retries, log)
+            used_parts = parts
+        except RangesNotSupported:
+            log(f"Server does not support ranges, downloading {os.path.basename(dest)} in one piece")
+            remove_partial(part_path, parts)
+
+    if used_parts == 1:
+        session = requests.Session()
+        with_retries(lambda: fetch_range(session, url, part_path, 0, None, headers), retries, log,
+                     f"Download of {os.path.basename(dest)}")
+
+    actual_size = get_partial_size(part_path)
+    if size is not None and actual_size != size:
+        remove_partial(part_path, parts)
+        raise DownloadError(f"{os.path.basename(dest)}: expected {size} bytes, got {actual_size}")
+    if algorithm:
+        actual_digest = get_file_digest(part_path, algorithm)
+        if actual_digest != expected_digest:
+            # A resumed download can mix two versions of a replaced asset, never keep it
+            remove_partial(part_path, parts)
+            raise DownloadError(f"{os.path.basename(dest)}: {algorithm} mismatch, expected {expected_digest}, got {actual_digest}")
+
+    os.replace(part_path, dest)
+    return {
+        "bytes": actual_size,
+        "resumed_from": resumed_from,
+        "parts": used_parts,
+        "wall_s": round(time.perf_counter() - start, 6),
+    }
@@ -1,8 +1,68 @@
 import os
-import hashlib
+import copy
+import filecmp
 import zipfile
 import xml.etree.ElementTree as ET
 import re
+import json
+import zlib
+import argparse
+import shutil
+import gzip
+import lzma
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from build_report import BuildReport, count, snapshot_counters, counters_since, profiled
+from checksums import HashCache, HASH_CACHE_FILE, publish_zip_sidecars, remove_orphaned_sidecars
+from publish import Publisher, write_json_atomic
+from repo_scan import scan_directory, scan_repository
+from watcher import DEFAULT_DEBOUNCE, RESCAN, open_watcher, wait_for_changes
+from zip_tools import AddonZip, build_zip, get_zip_digest, is_excluded_path, read_central_directory_crc
+
+# Build manifest, keyed by zip path. Lets unchanged addons skip zip inflation and asset extraction.
+BUILD_CACHE_FILE = ".repo-cache.json"
+BUILD_CACHE_VERSION = 2
+
+# Assets extracted from every addon zip, in addition to the ones listed under <assets>
+DEFAULT_ASSETS = ['icon.png', 'fanart.jpg', 'icon.gif', 'fanart.png']
+
+# Files in an addon directory that are never treated as assets, neither extracted nor pruned
+PROTECTED_FILES = ['index.html', 'addon.xml']
+
+# Buffer size for streaming assets out of zips and for hashing files on disk
+COPY_BUFFER_SIZE = 64 * 1024
+
+# Variants of the repository addon, e.g. one that downloads through a proxy. See load_mirrors().
+MIRRORS_FILE = "mirrors.json"
+DEFAULT_MIRRORS = [{"id_suffix": ""}]
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# Files in the repository root that the repository addons are built from. In --watch mode
+# a change to one of them triggers a full build, other changes only affect their directory.
+REPOSITORY_INPUTS = ['addon.xml', MIRRORS_FILE, 'icon.png', 'icon.jpg', 'fanart.jpg']
+
+# Shards of addons.xml per --shards scheme, each written to addons-<shard>.xml. The first
+# shard takes every addon that matches no other. The list is fixed and every shard is written,
+# even when empty, because the repository addons list them as <dir> entries and Kodi only
+# picks up a changed repository addon together with a new version.
+SHARD_SCHEMES = {
+    "platform": ["plain", "binary"],
+    "type": ["other", "repositories", "plugins", "scripts", "scrapers", "skins", "binary"],
+}
+# Shard of the "type" scheme by extension point. Checked in this order and the first point the
+# addon has wins, whatever the order of its extensions, e.g. a plugin with a service goes to plugins.
+# xbmc.metadata.scraper stands for all xbmc.metadata.scraper.* points.
+SHARD_EXTENSION_POINTS = {
+    "xbmc.addon.repository": "repositories",
+    "xbmc.gui.skin": "skins",
+    "xbmc.metadata.scraper": "scrapers",
+    "xbmc.python.pluginsource": "plugins",
+    "xbmc.python.script": "scripts",
+    "xbmc.service": "scripts",
+}
 
 def get_addon_info(addon_xml_path):
     try:
@@ -17,403 +77,757 @@ def get_addon_info(addon_xml_path):
     return None, None, None
 
 def create_zip(source_dir, output_zip):
-    with zipfile.ZipFile(output_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # Get the parent directory name to ensure consistent structure inside zip
-        parent_dir = os.path.dirname(os.path.abspath(source_dir))
-        
-        for root, dirs, files in os.walk(source_dir):
-            for file in files:
-                if file.endswith(".zip") or file.endswith(".pyc") or file == "generate_repo.py" or file.startswith("."):
-                    continue
-                file_path = os.path.join(root, file)
-                # Calculate relative path from the parent of source_dir
-                # If source_dir is ./plugin.video.foo, zip should contain plugin.video.foo/addon.xml
-                archive_name = os.path.relpath(file_path, parent_dir)
-                zf.write(file_path, archive_name)
-    print(f"Created {output_zip}")
-
-def generate_repo():
-    addons_xml = u"<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?>\n<addons>\n"
+    # Get the parent directory name to ensure consistent structure inside zip
+    parent_dir = os.path.dirname(os.path.abspath(source_dir))
+    entries = {}
     
-    # Process subdirectories
-    for item in os.listdir("."):
-        if os.path.isdir(item) and item != "." and item != ".." and not item.startswith("."):
+    for root, dirs, files in os.walk(source_dir):
+        # Same exclusions as for repacked release zips, see zip_tools.is_excluded_path()
+        dirs[:] = [d for d in dirs if not is_excluded_path(d)]
+        for file in files:
+            file_path = os.path.join(root, file)
+            # Calculate relative path from the parent of source_dir
+            # If source_dir is ./plugin.video.foo, zip should contain plugin.video.foo/addon.xml
+            archive_name = os.path.relpath(file_path, parent_dir).replace(os.sep, "/")
+            # Only the path inside the addon, the name of source_dir itself may start with "."
+            if file == "generate_repo.py" or is_excluded_path(os.path.relpath(file_path, source_dir).replace(os.sep, "/")):
+                continue
+            entries[archive_name] = file_path
+
+    if not entries:
+        raise ValueError(f"{source_dir} has no files to pack into {output_zip}")
+
+    # Deterministic zip, written to a temp file and renamed into place.
+    # Skipped when the existing zip was built from the same files.
+    _, built = build_zip(output_zip, entries)
+    print(f"Created {output_zip}" if built else f"Unchanged {output_zip}")
+
+def load_build_cache(cache_path=BUILD_CACHE_FILE):
+    """
+    Loads the build manifest written by the previous run.
+    Returns an empty manifest if the file is missing, unreadable or has an older format.
+    """
+    cache = None
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable build cache {cache_path}: {e}")
+
+    if not isinstance(cache, dict) or cache.get("version") != BUILD_CACHE_VERSION or not isinstance(cache.get("zips"), dict):
+        cache = {"version": BUILD_CACHE_VERSION, "zips": {}}
+    # addons.xml fragment per directory, reused by --changed-since
+    if not isinstance(cache.get("fragments"), dict):
+        cache["fragments"] = {}
+    cache["hits"] = 0
+    return cache
+
+def save_build_cache(cache, cache_path=BUILD_CACHE_FILE):
+    write_json_atomic(cache_path, cache, ensure_ascii=False)
+
+def get_changed_paths(rev):
+    """
+    Paths below the current directory that changed since git revision rev: tracked files
+    that were modified, added or deleted, plus untracked ones, e.g. zips update_repo.py
+    just downloaded. Returns None if git fails, e.g. for an unknown revision.
+    """
+    commands = [
+        ["git", "diff", "--name-only", "--no-renames", "--relative", "-z", rev, "--"],
+        ["git", "ls-files", "--others", "--exclude-standard", "-z"],
+    ]
+    paths = set()
+    for cmd in commands:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Error running {' '.join(cmd)}: {result.stderr.strip()}")
+            return None
+        paths.update(path for path in result.stdout.split("\0") if path)
+    return paths
+
+def get_dirs_to_rebuild(rev, items, cache):
+    """
+    Directories of items that changed since git revision rev or have no addons.xml fragment
+    in the build manifest. Returns None if everything has to be rebuilt: git failed, or the
+    repository addon inputs or the generator scripts in the root changed.
+    """
+    paths = get_changed_paths(rev)
+    if paths is None:
+        return None
+
+    changed = set()
+    for path in paths:
+        top, separator, _ = path.partition("/")
+        if not separator:
+            if top in REPOSITORY_INPUTS or top.endswith(".py"):
+                print(f"{top} changed since {rev}, rebuilding everything")
+                return None
+            continue
+        changed.add(top)
+    return {item for item in items if item in changed or item not in cache["fragments"]}
+
+def get_central_directory_crc(zip_path):
+    """zip_tools.read_central_directory_crc() of the zip at zip_path."""
+    with open(zip_path, "rb") as f:
+        return read_central_directory_crc(f)
+
+def get_cached_zip_entry(cache, cache_key, zip_path, file_entry=None):
+    """
+    Returns the cached entry for a zip if it has not changed since it was cached, else None.
+    Size and mtime are compared first, taken from file_entry (a repo_scan.FileEntry) if given.
+    If only the mtime differs (e.g. after a fresh git checkout in CI) the central directory CRC decides.
+    """
+    entry = cache["zips"].get(cache_key)
+    if not entry:
+        return None
+    try:
+        if file_entry is None:
+            st = os.stat(zip_path)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        else:
+            size, mtime_ns = file_entry.size, file_entry.mtime_ns
+        if entry.get("size") != size:
+            return None
+        if entry.get("mtime") != mtime_ns:
+            if entry.get("crc") != get_central_directory_crc(zip_path):
+                return None
+            entry["mtime"] = mtime_ns
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+    cache["hits"] += 1
+    return entry
+
+def parse_addon_xml(addon_xml_content):
+    """
+    Parses addon.xml content from memory.
+    Returns (root, addon_id, version). root is None if the XML is malformed,
+    in which case id and version are recovered with a regex.
+    """
+    try:
+        root = ET.fromstring(addon_xml_content)
+        return root, root.get('id'), root.get('version')
+    except ET.ParseError:
+        addon_id = None
+        version = None
+        # Try regex fallback on content
+        id_match = re.search(r'id="([^"]+)"', addon_xml_content)
+        ver_match = re.search(r'version="([^"]+)"', addon_xml_content)
+        if id_match: addon_id = id_match.group(1)
+        if ver_match: version = ver_match.group(1)
+        return None, addon_id, version
+
+class PlatformZip:
+    """A platform zip of a binary addon and the <platform> value it is published under."""
+    __slots__ = ("platform", "path")
+
+    def __init__(self, platform, path):
+        self.platform = platform
+        self.path = path
+
+class BinaryAddon:
+    """
+    addon.xml of a binary addon, parsed once and published once per platform zip.
+    A platform entry is a shallow clone of the tree: only the root, the metadata extension
+    and the elements next to <platform> and <path> are new, everything else is shared.
+    """
+    __slots__ = ("id", "version", "root", "metadata_index", "platform_zips")
+
+    def __init__(self, root):
+        self.root = root
+        self.id = root.get('id')
+        self.version = root.get('version')
+        self.metadata_index = None
+        for index, child in enumerate(root):
+            if child.tag == 'extension' and child.get('point') == 'xbmc.addon.metadata':
+                self.metadata_index = index
+                break
+        self.platform_zips = []
+
+    def add_platform_zip(self, item, zip_file):
+        """
+        Adds a zip named addon_id-version-platform.zip from directory item.
+        Zips of other versions are ignored.
+        """
+        prefix = f"{self.id}-{self.version}-"
+        if not zip_file.startswith(prefix):
+            return
+        platform = zip_file[len(prefix):-4] # remove prefix and .zip
+
+        # For linux-armv7, also add "linux" as fallback platform
+        if platform == 'linux-armv7':
+            platform = 'linux-armv7 linux'
+
+        # Note: path should be relative to datadir.
+        # datadir is repo/master/.
+        # file is at repo/plugin.video.foo/file.zip
+        self.platform_zips.append(PlatformZip(platform, f"{item}/{zip_file}"))
+
+    def platform_entry(self, platform_zip):
+        """Clone of the addon element with <platform> and <path> of platform_zip."""
+        metadata = self.root[self.metadata_index]
+        children = [child for child in metadata if child.tag not in ('platform', 'path')]
+
+        # Indent new tags like the existing children and keep the indent of </extension>
+        indent = "\n" + (metadata.text or "").rsplit("\n", 1)[-1] if metadata.text and metadata.text.strip() == "" else "\n        "
+        closing = metadata[-1].tail if len(metadata) and metadata[-1].tail is not None else "\n    "
+
+        platform = ET.Element('platform')
+        platform.text = platform_zip.platform
+        platform.tail = indent
+        path = ET.Element('path')
+        path.text = platform_zip.path
+        path.tail = closing
+
+        new_metadata = copy.copy(metadata)
+        if children:
+            # The tail of the last kept child now leads to <platform>, so it can't be shared
+            last = copy.copy(children[-1])
+            last.tail = indent
+            children[-1] = last
+        else:
+            new_metadata.text = indent
+        new_metadata[:] = children + [platform, path]
+
+        entry = copy.copy(self.root)
+        entry[self.metadata_index] = new_metadata
+        return entry
+
+    def platform_entries(self):
+        """addons.xml fragments for all platform zips, in the order they were added."""
+        if self.metadata_index is None:
+            return []
+        entries = []
+        for platform_zip in self.platform_zips:
+            xml = ET.tostring(self.platform_entry(platform_zip), encoding='unicode')
+            # Remove ns0: prefixes if ElementTree added them
+            if 'ns0' in xml:
+                xml = xml.replace('ns0:', '').replace(':ns0', '')
+            entries.append(xml.strip() + "\n")
+        return entries
+
+def get_addon_assets(addon_xml_content):
+    """Returns the asset paths referenced by addon.xml, plus DEFAULT_ASSETS."""
+    assets_to_extract = set(DEFAULT_ASSETS)
+
+    try:
+        try:
+            root_xml = ET.fromstring(addon_xml_content)
             
-            # Check for binary platform specific zips first
-            platform_zips = []
-            for file in os.listdir(item):
-                if file.endswith(".zip"):
-                    # pattern: ID-Version-Platform.zip
-                    # but standard is ID-Version.zip
-                    # we look for the 3rd component
-                    parts = file[:-4].split('-') # remove .zip
-                    if len(parts) > 2:
-                        # Simple heuristic: if filename contains platform keywords
-                        # This relies on update_repo.py naming convention
-                        platform = None
-                        if 'android' in file: platform = 'android'
-                        elif 'windows' in file: platform = 'windows'
-                        elif 'linux' in file: platform = 'linux'
-                        elif 'osx' in file: platform = 'osx'
-                        elif 'ios' in file: platform = 'ios'
-                        
-                        if platform:
-                             platform_zips.append(file)
-
-            # Standard processing
-            addon_xml_path = os.path.join(item, "addon.xml")
-            addon_xml_content = None
-
-            # If no addon.xml but we have zips (downloaded from sources), try to extract one
-            if len(os.listdir(item)) > 0:
-                 # Try to find a zip to extract addon.xml and assets from
-                 zips = [f for f in os.listdir(item) if f.endswith('.zip')]
-                 if zips:
-                     # Sort zips by version, assuming format name-version.zip
-                     try:
-                        # Extract the version part. This logic could be fragile.
-                        # We use LooseVersion-like sorting or just sort by name (usually works for version numbers with same length)
-                        # A better way is to try to parse versions
-                        def get_version_key(filename):
-                            # Remove .zip
-                            base = filename[:-4]
-                            
-                            # Try to find version using regex (e.g., 1.2.3 or 1.2.3.4)
-                            # Matches version numbers surrounded by - or end of string
-                            import re
-                            # This regex looks for digits.digits... possibly followed by more .digits
-                            # It tries to find the version segment in the filename
-                            # We assume the version is the first segment that looks like X.Y.Z
-                            # surrounded by hyphens or end of string
-                            # Typical formats: addon.id-1.2.3.zip, addon.id-1.2.3-matrix.zip
-                            
-                            parts = base.split('-')
-                            # Iterate parts to find the one that looks like a version
-                            for part in parts:
-                                if re.match(r'^\d+(\.\d+)+[a-z0-9]*$', part):
-                                    try:
-                                        # Convert to tuple of ints for proper comparison
-                                        # e.g. 1.10 > 1.2
-                                        # Handle suffixes like 1.2.3a
-                                        v_clean = re.sub(r'[^0-9\.]', '', part)
-                                        return [int(x) for x in v_clean.split('.') if x]
-                                    except ValueError:
-                                        pass
-                            
-                            return filename
-
-                        # Sort descending, so highest version is first
-                        zips.sort(key=get_version_key, reverse=True) 
-                     except Exception:
-                        zips.sort(reverse=True) # Fallback to string sort
-
-                     # Pick the latest zip
-                     target_zip = zips[0]
-                     
-                     try:
-                         with zipfile.ZipFile(os.path.join(item, target_zip), 'r') as zf:
-                             root_folder = None
-                             for name in zf.namelist():
-                                 if name.endswith('addon.xml') and name.count('/') == 1:
-                                     root_folder = name[:-9] # remove addon.xml
-                                     break
-                                     
-                             if root_folder:
-                                 # Read addon.xml content directly from zip
-                                 try:
-                                     with zf.open(root_folder + "addon.xml") as source:
-                                         addon_xml_content = source.read().decode('utf-8')
-                                 except KeyError:
-                                     pass 
-                                         
-                                 # Extract assets (icon.png, fanart.jpg, etc) based on addon.xml content
-                                 # Parse addon.xml to find assets
-                                 assets_to_extract = set(['icon.png', 'fanart.jpg', 'icon.gif', 'fanart.png'])
-                                 
-                                 try:
-                                     if addon_xml_content:
-                                        try:
-                                            root_xml = ET.fromstring(addon_xml_content)
-                                            
-                                            # Handle standard assets tag
-                                            for extension in root_xml.findall("extension"):
-                                                # Also check if it's metadata
-                                                point = extension.get("point")
-                                                if point == "xbmc.addon.metadata":
-                                                    # Look for <assets>
-                                                    assets_elem = extension.find("assets")
-                                                    if assets_elem is not None:
-                                                        for child in assets_elem:
-                                                            if child.text:
-                                                                assets_to_extract.add(child.text.strip())
-                                        except ET.ParseError:
-                                            # Fallback: simple text parsing if XML is malformed or weirdly encoded
-                                            if '<assets>' in addon_xml_content:
-                                                assets_match = re.search(r'<assets>(.*?)</assets>', addon_xml_content, re.DOTALL)
-                                                if assets_match:
-                                                    inner = assets_match.group(1)
-                                                    # Find all tags inside
-                                                    tags = re.findall(r'<([^>]+)>([^<]+)</\1>', inner)
-                                                    for tag, text in tags:
-                                                        assets_to_extract.add(text.strip())
-
-                                 except Exception as e:
-                                     print(f"Error parsing assets XML: {e}")
-
-                                 for asset in assets_to_extract:
-                                     asset = asset.strip()
-                                     if not asset: continue
-                                     
-                                     # Normalize path separators for zip lookup
-                                     asset_norm = asset.replace('\\', '/')
-                                     
-                                     # In zip: "plugin.video.foo/resources/image.jpg"
-                                     asset_path_in_zip = root_folder + asset_norm
-                                     
-                                     # On disk: "plugin.video.foo/resources/image.jpg"
-                                     # (relative to current working directory, item is the plugin folder)
-                                     local_asset_path = os.path.join(item, asset_norm)
-                                     
-                                     try:
-                                         if asset_path_in_zip in zf.namelist():
-                                             # Ensure subdirectories exist
-                                             os.makedirs(os.path.dirname(local_asset_path), exist_ok=True)
-                                             
-                                             with zf.open(asset_path_in_zip) as source, open(local_asset_path, "wb") as target:
-                                                 target.write(source.read())
-                                     except (KeyError, FileNotFoundError):
-                                         pass
-                     except Exception as e:
-                         print(f"Error extracting from {target_zip}: {e}")
-
-            if addon_xml_content:
-                # Parse XML content from memory instead of file
-                try:
-                    root = ET.fromstring(addon_xml_content)
-                    addon_id = root.get('id')
-                    version = root.get('version')
-                except ET.ParseError:
-                    addon_id = None
-                    version = None
-                    # Try regex fallback on content
-                    id_match = re.search(r'id="([^"]+)"', addon_xml_content)
-                    ver_match = re.search(r'version="([^"]+)"', addon_xml_content)
-                    if id_match: addon_id = id_match.group(1)
-                    if ver_match: version = ver_match.group(1)
-
-                if addon_id and version:
-                    
-                    # If we found platform specific zips, we need to generate multiple entries
-                    # or inject platform tags
-                    processed_platforms = False
-                    
-                    if platform_zips:
-                        # We have binary platform zips. We need to duplicate the xml entry for each platform
-                        # and inject <platform> and <path> tags
-                        
-                        base_xml_content = ET.tostring(root, encoding='unicode', method='xml')
-                        # Remove ns0: prefixes if ElementTree added them
-                        base_xml_content = base_xml_content.replace('ns0:', '').replace(':ns0', '')
-                        
-                        # Parse regex to matching platform zips more accurately
-                        # update_repo.py naming: addon_id-version-platform.zip
-                        # Sort platform_zips so that linux-armv7 comes last.
-                        # This is important because on devices where Kodi is compiled with
-                        # -march=armv8-a in 32-bit mode (e.g. CoreELEC Amlogic-ng),
-                        # __ARM_ARCH_7A__ is not defined, so the device's supportedPlatforms
-                        # only contains ["all", "linux"] without "linux-armv7".
-                        # We tag linux-armv7 entries with "linux-armv7 linux" as a fallback,
-                        # but this also matches x86_64/aarch64 devices. By placing it last,
-                        # AddAddonIfLatest (which uses strict >) won't overwrite the
-                        # architecture-specific entry that was already stored.
-                        def platform_sort_key(f):
-                            return (1 if 'linux-armv7' in f else 0, f)
-                        platform_zips.sort(key=platform_sort_key)
-
-                        for zip_file in platform_zips:
-                            # Parse platform from filename: plugin.video.foo-1.0.0-windows-x86_64.zip
-                            # We know the ID and Version.
-                            prefix = f"{addon_id}-{version}-"
-                            if zip_file.startswith(prefix):
-                                platform_str = zip_file[len(prefix):-4] # remove prefix and .zip
-
-                                # For linux-armv7, also add "linux" as fallback platform
-                                if platform_str == 'linux-armv7':
-                                    platform_str = 'linux-armv7 linux'
-
-                                # Now modify the XML for this platform
-                                # We'll do string manipulation for simplicity as ET can be tricky with namespaces/attributes
-                                
-                                # 1. Find the extension metadata block
-                                metadata_pattern = r'(<extension point="xbmc\.addon\.metadata"[^>]*>)(.*?)(</extension>)'
-                                match = re.search(metadata_pattern, base_xml_content, re.DOTALL)
-                                
-                                if match:
-                                    start_tag = match.group(1)
-                                    inner_content = match.group(2)
-                                    end_tag = match.group(3)
-                                    
-                                    # Override/Add platform
-                                    # Remove existing platform tag if any
-                                    inner_content = re.sub(r'<platform>.*?</platform>', '', inner_content)
-                                    # Add new platform tag
-                                    inner_content += f'\n            <platform>{platform_str}</platform>'
-                                    # Add path tag
-                                    # Note: path should be relative to datadir. 
-                                    # datadir is repo/master/. 
-                                    # file is at repo/plugin.video.foo/file.zip
-                                    inner_content += f'\n            <path>{item}/{zip_file}</path>\n    '
-                                    
-                                    new_entry = base_xml_content.replace(match.group(0), f"{start_tag}{inner_content}{end_tag}")
-                                    addons_xml += new_entry.strip() + "\n"
-                                    processed_platforms = True
-                    
-                    # If it wasn't a recognized binary platform set updates, or just a regular addon
-                    if not processed_platforms:
-                        # Create zip if not exists (for locally developed addons)
-                        zip_name = f"{addon_id}-{version}.zip"
-                        zip_path = os.path.join(item, zip_name)
-                        if not os.path.exists(zip_path) and not any(f.endswith('.zip') for f in os.listdir(item)):
-                             create_zip(item, zip_path)
-                        
-                        # Add to XML
-                        if addon_xml_content:
-                            content = addon_xml_content
-                            lines = content.splitlines()
-                            if lines[0].startswith("<?xml"):
-                                content = "\n".join(lines[1:])
-                            addons_xml += content.strip() + "\n"
-    
-    # Create repository.forbxy zip from current directory addon.xml
-    if os.path.exists("addon.xml"):
-        repo_addon_xml = "addon.xml"
+            # Handle standard assets tag
+            for extension in root_xml.findall("extension"):
+                # Also check if it's metadata
+                point = extension.get("point")
+                if point == "xbmc.addon.metadata":
+                    # Look for <assets>
+                    assets_elem = extension.find("assets")
+                    if assets_elem is not None:
+                        for child in assets_elem:
+                            if child.text:
+                                assets_to_extract.add(child.text.strip())
+        except ET.ParseError:
+            # Fallback: simple text parsing if XML is malformed or weirdly encoded
+            if '<assets>' in addon_xml_content:
+                assets_match = re.search(r'<assets>(.*?)</assets>', addon_xml_content, re.DOTALL)
+                if assets_match:
+                    inner = assets_match.group(1)
+                    # Find all tags inside
+                    tags = re.findall(r'<([^>]+)>([^<]+)</\1>', inner)
+                    for tag, text in tags:
+                        assets_to_extract.add(text.strip())
+
+    except Exception as e:
+        print(f"Error parsing assets XML: {e}")
+
+    return assets_to_extract
+
+def is_safe_asset_path(asset):
+    """Asset paths come from addon.xml, only allow plain relative paths inside the addon directory."""
+    parts = asset.split('/')
+    return bool(asset) and not asset.startswith('/') and ':' not in parts[0] and '..' not in parts \
+        and not asset.endswith('.zip') and asset not in PROTECTED_FILES
+
+def get_file_crc(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def sync_assets(zf, root_folder, assets, item):
+    """
+    Brings assets (paths relative to the addon root) on disk in line with an open AddonZip.
+    Files whose size and CRC32 already match the zip's central directory are left alone,
+    the rest is streamed out of the zip into a temp file and renamed into place.
+    Returns {asset: [size, crc]} for the assets found in the zip.
+    """
+    synced = {}
+    for asset in assets:
+        # In zip: "plugin.video.foo/resources/image.jpg"
+        asset_path_in_zip = root_folder + asset
+        
+        # On disk: "plugin.video.foo/resources/image.jpg"
+        # (relative to current working directory, item is the plugin folder)
+        local_asset_path = os.path.join(item, asset)
+        
         try:
-            tree = ET.parse(repo_addon_xml)
-            root = tree.getroot()
-            repo_id = root.get('id')
-            repo_version = root.get('version')
+            info = zf.getinfo(asset_path_in_zip)
+            synced[asset] = [info.file_size, info.CRC]
+
+            if os.path.isfile(local_asset_path) and os.path.getsize(local_asset_path) == info.file_size \
+                    and get_file_crc(local_asset_path) == info.CRC:
+                continue
+
+            # Ensure subdirectories exist
+            os.makedirs(os.path.dirname(local_asset_path), exist_ok=True)
             
-            if repo_id and repo_version:
-                repo_zip_name = f"{repo_id}-{repo_version}.zip"
-                # Ensure repo directory exists
-                if not os.path.exists(repo_id):
-                    os.makedirs(repo_id)
-                repo_zip_path = os.path.join(repo_id, repo_zip_name)
-                # Ensure the zip is also copied to root for flat index.html access
-                root_zip_path = repo_zip_name
+            temp_path = os.path.join(os.path.dirname(local_asset_path), "." + os.path.basename(local_asset_path) + ".tmp")
+            with zf.open(info) as source, open(temp_path, "wb") as target:
+                shutil.copyfileobj(source, target, COPY_BUFFER_SIZE)
+            os.replace(temp_path, local_asset_path)
+            count("assets_extracted")
+            count("bytes_written", info.file_size)
+            print(f"Updated asset {local_asset_path}")
+        except (KeyError, FileNotFoundError):
+            pass
+    return synced
+
+def prune_assets(item, assets):
+    """
+    Removes assets that an older addon.xml referenced but the current one no longer does,
+    along with directories left empty by that.
+    """
+    for asset in sorted(assets):
+        if not is_safe_asset_path(asset):
+            continue
+        local_asset_path = os.path.join(item, asset)
+        if not os.path.isfile(local_asset_path):
+            continue
+
+        os.remove(local_asset_path)
+        count("assets_pruned")
+        print(f"Removed stale asset {local_asset_path}")
+
+        parent = os.path.dirname(local_asset_path)
+        while os.path.normpath(parent) != os.path.normpath(item):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+def read_addon_zip(zip_path, item):
+    """
+    Reads addon.xml from an addon zip and syncs its assets into the addon directory.
+    Returns a build cache entry, or None if the zip has no root addon.xml.
+    """
+    with AddonZip(zip_path) as zf:
+        root_folder = zf.root_folder
+        if not root_folder:
+            return None
+
+        # Read addon.xml content directly from zip
+        addon_xml_content = zf.read_addon_xml()
+
+        # Only keep assets that actually exist in the zip
+        assets = set()
+        for asset in get_addon_assets(addon_xml_content):
+            asset = asset.strip()
+            if not asset: continue
+            
+            # Normalize path separators for zip lookup
+            asset_norm = asset.replace('\\', '/')
+            if is_safe_asset_path(asset_norm) and root_folder + asset_norm in zf:
+                assets.add(asset_norm)
+
+        assets = sync_assets(zf, root_folder, sorted(assets), item)
+        crc = zf.central_directory_crc()
+
+    _, addon_id, version = parse_addon_xml(addon_xml_content)
+    st = os.stat(zip_path)
+    return {
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+        "crc": crc,
+        "root_folder": root_folder,
+        "addon_xml": addon_xml_content,
+        "id": addon_id,
+        "version": version,
+        "assets": assets,
+    }
+
+def process_addon_dir(item, cache, listing=None):
+    """
+    Processes one addon directory: picks the newest zip, extracts addon.xml and assets
+    and builds the addons.xml entries for it.
+    Only touches files inside item, so directories can be processed in worker processes.
+    cache holds the build manifest entries of this directory. listing is its
+    repo_scan.DirectoryListing, the directory is scanned here if it is not given.
+    Returns (addons.xml fragment, manifest entries used, stats) where stats holds the wall
+    and CPU time, the manifest hits and the counters collected for this directory.
+    """
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_counters = snapshot_counters()
+
+    addons_xml = ""
+    cache_entries = {}
+    if listing is None:
+        listing = scan_directory(item)
+
+    # Check for binary platform specific zips first (update_repo.py naming, see repo_scan.is_platform_zip)
+    platform_zips = listing.platform_zips()
+
+    # Standard processing
+    addon_xml_content = None
+    entry = None
+
+    # Zips sorted descending, so highest version is first
+    zips = listing.zips()
+
+    # If no addon.xml but we have zips (downloaded from sources), extract addon.xml and assets from the latest
+    if zips:
+        # Pick the latest zip
+        target_zip = zips[0]
+        target_zip_path = os.path.join(item, target_zip)
+        cache_key = f"{item}/{target_zip}"
+
+        try:
+            # Unchanged zips are served from the build cache, only assets that are
+            # missing or have the wrong size on disk are synced again
+            entry = get_cached_zip_entry(cache, cache_key, target_zip_path, listing.files[target_zip])
+            if entry:
+                stale_assets = []
+                for asset, (size, crc) in entry["assets"].items():
+                    local_asset_path = os.path.join(item, asset)
+                    if not os.path.isfile(local_asset_path) or os.path.getsize(local_asset_path) != size:
+                        stale_assets.append(asset)
+                if stale_assets:
+                    with AddonZip(target_zip_path) as zf:
+                        sync_assets(zf, entry["root_folder"], stale_assets, item)
+            else:
+                count("cache_misses")
+                entry = read_addon_zip(target_zip_path, item)
+
+            # Assets of the previously cached zip that the current addon.xml no longer lists
+            if entry:
+                previous_assets = set()
+                for key, previous in cache["zips"].items():
+                    if key != cache_key:
+                        previous_assets.update(previous.get("assets", {}))
+                prune_assets(item, previous_assets - set(entry["assets"]))
+        except Exception as e:
+            entry = None
+            print(f"Error extracting from {target_zip}: {e}")
+
+        if entry:
+            cache_entries[cache_key] = entry
+            addon_xml_content = entry["addon_xml"]
+
+    if addon_xml_content:
+        addon_id = entry["id"]
+        version = entry["version"]
+
+        if addon_id and version:
+            
+            # If we found platform specific zips, we need to generate multiple entries
+            # or inject platform tags
+            processed_platforms = False
+            
+            # The tree is only needed for the platform fan-out, plain addons are copied as text
+            root = parse_addon_xml(addon_xml_content)[0] if platform_zips else None
+
+            if platform_zips and root is not None:
+                # We have binary platform zips. The addon.xml is parsed once and every
+                # platform zip gets a clone of it with <platform> and <path> set.
+                addon = BinaryAddon(root)
+
+                # Sort platform_zips so that linux-armv7 comes last.
+                # This is important because on devices where Kodi is compiled with
+                # -march=armv8-a in 32-bit mode (e.g. CoreELEC Amlogic-ng),
+                # __ARM_ARCH_7A__ is not defined, so the device's supportedPlatforms
+                # only contains ["all", "linux"] without "linux-armv7".
+                # We tag linux-armv7 entries with "linux-armv7 linux" as a fallback,
+                # but this also matches x86_64/aarch64 devices. By placing it last,
+                # AddAddonIfLatest (which uses strict >) won't overwrite the
+                # architecture-specific entry that was already stored.
+                def platform_sort_key(f):
+                    return (1 if 'linux-armv7' in f else 0, f)
+                platform_zips.sort(key=platform_sort_key)
+
+                # update_repo.py naming: addon_id-version-platform.zip
+                for zip_file in platform_zips:
+                    addon.add_platform_zip(item, zip_file)
+
+                entries = addon.platform_entries()
+                if entries:
+                    addons_xml += "".join(entries)
+                    processed_platforms = True
+            
+            # If it wasn't a recognized binary platform set updates, or just a regular addon
+            if not processed_platforms:
+                # Create zip if not exists (for locally developed addons)
+                zip_name = f"{addon_id}-{version}.zip"
+                zip_path = os.path.join(item, zip_name)
+                if not zips:
+                     create_zip(item, zip_path)
                 
-                print(f"Creating repository zip: {repo_zip_path}")
-                with zipfile.ZipFile(repo_zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                     zf.write("addon.xml", f"{repo_id}/addon.xml")
-                     # Also include icon/fanart if they exist
-                     for extra in ['icon.png', 'icon.jpg', 'fanart.jpg']:
-                         if os.path.exists(extra):
-                             zf.write(extra, f"{repo_id}/{extra}")
-                             # Also copy to disk for direct access if needed
-                             import shutil
-                             shutil.copy2(extra, f"{repo_id}/{extra}")
-                             
-                # Copy zip to root for flat access
-                import shutil
-                shutil.copy2(repo_zip_path, root_zip_path)
-                             
-                # Also Add repo itself to addons.xml
-                with open(repo_addon_xml, "r", encoding="utf-8") as f:
-                    content = f.read()
+                # Add to XML
+                if addon_xml_content:
+                    content = addon_xml_content
                     lines = content.splitlines()
                     if lines[0].startswith("<?xml"):
                         content = "\n".join(lines[1:])
                     addons_xml += content.strip() + "\n"
 
-        except Exception as e:
-            print(f"Error packing repository addon: {e}")
+    stats = {
+        "wall_s": round(time.perf_counter() - start_wall, 6),
+        "cpu_s": round(time.process_time() - start_cpu, 6),
+        "cache_hits": cache["hits"],
+    }
+    stats.update(counters_since(start_counters))
+    return addons_xml, cache_entries, stats
+
+def use_compressed_index(repository_extension, extension="gz"):
+    """
+    Points <info> and <checksum> of a parsed xbmc.addon.repository extension at
+    addons.xml.<extension> and its checksum file.
+    """
+    for info in repository_extension.iter('info'):
+        if info.text and info.text.strip().endswith('addons.xml'):
+            info.text = f"{info.text.strip()}.{extension}"
+            info.set('compressed', 'true')
+    for checksum in repository_extension.iter('checksum'):
+        if checksum.text and checksum.text.strip().endswith('addons.xml.md5'):
+            checksum.text = f"{checksum.text.strip()[:-len('.md5')]}.{extension}.md5"
+
+def load_mirrors(mirrors_path=MIRRORS_FILE):
+    """
+    Repository addon variants from mirrors.json. Every mirror may have
+      id_suffix      appended to the addon id, "" for the plain repository addon
+      name_suffix    appended to the addon and repository names
+      rewrite        [old prefix, new prefix] pairs applied to <info>, <checksum> and <datadir>
+      info_url       base URL replacing the one of <info>, the file name is kept
+      checksum_url   base URL replacing the one of <checksum>, the file name is kept
+    Without mirrors.json only the plain repository addon is built.
+    """
+    if not os.path.exists(mirrors_path):
+        return DEFAULT_MIRRORS
+    with open(mirrors_path, "r", encoding="utf-8") as f:
+        return json.load(f)["mirrors"]
 
-    # Create repository.forbxy.ghproxy zip (Clone of repository.forbxy but with gh-proxy links)
-    if os.path.exists("addon.xml"):
+def get_shard_index_path(shard):
+    return f"addons-{shard}.xml"
+
+def use_shards(repository_extension, shards):
+    """
+    Replaces the <dir> of a parsed xbmc.addon.repository extension with one copy per shard,
+    whose <info> and <checksum> point at addons-<shard>.xml instead of addons.xml.
+    """
+    dirs = repository_extension.findall('dir')
+    if not dirs:
+        raise ValueError("sharding needs the <dir> form of the xbmc.addon.repository extension")
+    template = dirs[0]
+    position = list(repository_extension).index(template)
+    # Whitespace before the first <dir>, every copy but the last is followed by it
+    indent = repository_extension.text if position == 0 else repository_extension[position - 1].tail
+    for d in dirs:
+        repository_extension.remove(d)
+
+    for offset, shard in enumerate(shards):
+        shard_dir = copy.deepcopy(template)
+        if offset < len(shards) - 1:
+            shard_dir.tail = indent
+        for element in shard_dir:
+            if element.tag in ('info', 'checksum') and element.text:
+                base, separator, name = element.text.strip().rpartition('/')
+                if name.startswith('addons.xml'):
+                    element.text = base + separator + get_shard_index_path(shard) + name[len('addons.xml'):]
+        repository_extension.insert(position + offset, shard_dir)
+
+def get_shard(fragment, scheme):
+    """Shard of --shards scheme that the addons.xml fragment of one addon directory goes into."""
+    shards = SHARD_SCHEMES[scheme]
+    try:
+        addons = ET.fromstring("<addons>" + fragment + "</addons>")
+    except ET.ParseError:
+        return shards[0]
+
+    # Entries of platform zips carry an os-arch platform like "windows-x86_64" or "linux-armv7 linux",
+    # plain addons "all", none, or only operating systems
+    for platform in addons.iter('platform'):
+        if platform.text and any('-' in name for name in platform.text.split()):
+            return "binary"
+    if scheme == "type":
+        points = set()
+        for extension in addons.iter('extension'):
+            point = extension.get('point', '')
+            points.add('xbmc.metadata.scraper' if point.startswith('xbmc.metadata.scraper.') else point)
+        for point, shard in SHARD_EXTENSION_POINTS.items():
+            if point in points:
+                return shard
+    return shards[0]
+
+def make_repository_variant(template, mirror, compressed_index=False, shards=None):
+    """
+    Copy of the parsed repository addon.xml with the id, names and URLs of one mirror.
+    With shards (a list of shard names) it gets one <dir> per shard.
+    """
+    root = copy.deepcopy(template)
+    root.set('id', root.get('id') + mirror.get("id_suffix", ""))
+
+    name_suffix = mirror.get("name_suffix", "")
+    if name_suffix and root.get('name'):
+        root.set('name', root.get('name') + name_suffix)
+
+    for extension in root.iter('extension'):
+        if extension.get('point') != 'xbmc.addon.repository':
+            continue
+        if name_suffix and extension.get('name'):
+            extension.set('name', extension.get('name') + name_suffix)
+        if compressed_index:
+            use_compressed_index(extension)
+        if shards:
+            use_shards(extension, shards)
+
+        for element in extension.iter():
+            if element.tag not in ('info', 'checksum', 'datadir') or not element.text:
+                continue
+            url = element.text.strip()
+            for old, new in mirror.get("rewrite", []):
+                if url.startswith(old):
+                    url = new + url[len(old):]
+            base_url = mirror.get(f"{element.tag}_url")
+            if base_url:
+                url = base_url.rstrip('/') + '/' + url.rsplit('/', 1)[-1]
+            element.text = url
+
+    return root
+
+def publish_index(publisher, fragments, xz=False, index_path="addons.xml"):
+    """
+    Streams the addons.xml fragments into index_path and index_path.gz (and index_path.xz)
+    in a single pass, hashing while writing, and stages the matching md5 files.
+    The gzip header is written with mtime 0, no file name and a fixed OS byte, and xz has no
+    timestamps, so the output only depends on the fragments and is identical across runs and platforms.
+    """
+    plain = publisher.open(index_path, hash_names=("md5",))
+    gz_file = publisher.open(index_path + ".gz", hash_names=("md5",))
+    gz = gzip.GzipFile(filename="", mode="wb", fileobj=gz_file, compresslevel=9, mtime=0)
+    xz_file = publisher.open(index_path + ".xz", hash_names=("md5",)) if xz else None
+    xz_compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=9) if xz else None
+
+    for fragment in fragments:
+        data = fragment.encode("utf-8")
+        plain.write(data)
+        gz.write(data)
+        if xz_compressor:
+            xz_file.write(xz_compressor.compress(data))
+
+    plain.close()
+    gz.close()
+    gz_file.close()
+    if xz_compressor:
+        xz_file.write(xz_compressor.flush())
+        xz_file.close()
+
+    md5 = plain.hexdigest("md5")
+    publisher.write_text(index_path + ".md5", md5)
+    print(f"Generated {index_path} (MD5: {md5})")
+
+    # Compressed variants of the same bytes, for repository addons that point <info> at them
+    for compressed_path, compressed in ((index_path + ".gz", gz_file), (index_path + ".xz", xz_file)):
+        if compressed:
+            compressed_md5 = compressed.hexdigest("md5")
+            publisher.write_text(compressed_path + ".md5", compressed_md5)
+            print(f"Generated {compressed_path} ({compressed.size} bytes, MD5: {compressed_md5})")
+
+    return md5
+
+def publish_shards(publisher, fragments, scheme, xz=False, shards=None):
+    """
+    Writes addons-<shard>.xml, with the same compressed variants and md5 files as addons.xml,
+    for every shard of scheme, or only for those in shards. fragments are the addons.xml
+    fragments of the addon directories and the repository addons.
+    """
+    grouped = {shard: [] for shard in SHARD_SCHEMES[scheme]}
+    for fragment in fragments:
+        grouped[get_shard(fragment, scheme)].append(fragment)
+
+    for shard, shard_fragments in grouped.items():
+        if shards is None or shard in shards:
+            publish_index(publisher, [XML_DECLARATION + "<addons>\n"] + shard_fragments + ["</addons>\n"],
+                          xz, get_shard_index_path(shard))
+
+def package_repository_addons(publisher, compressed_index=False, mirrors_path=MIRRORS_FILE, shards=None):
+    """
+    Builds one repository addon zip per mirror in mirrors.json (repository.forbxy,
+    repository.forbxy.ghproxy, ...) from the addon.xml in the repository root and stages
+    them, plus their flat copies in the root. addon.xml is parsed once, every variant is
+    zipped from memory and zips built from unchanged inputs are left alone.
+    With shards (a --shards scheme) they list one <dir> per shard.
+    Returns the addons.xml fragments of the repository addons.
+    """
+    fragments = []
+    if not os.path.exists("addon.xml"):
+        return fragments
+
+    try:
+        # Comments are kept, so the addon.xml in the zips only differs where a mirror changes it
+        parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+        template = ET.parse("addon.xml", parser=parser).getroot()
+        mirrors = load_mirrors(mirrors_path)
+    except (OSError, ValueError, KeyError, ET.ParseError) as e:
+        print(f"Error packing repository addon: {e}")
+        return fragments
+
+    extras = [extra for extra in ['icon.png', 'icon.jpg', 'fanart.jpg'] if os.path.exists(extra)]
+
+    for mirror in mirrors:
         try:
-             # Parse original again
-             with open("addon.xml", "r", encoding="utf-8") as f:
-                 orig_xml_content = f.read()
-
-             # Modify ID, Name, and Links
-             proxy_xml_content = orig_xml_content.replace('id="repository.forbxy"', 'id="repository.forbxy.ghproxy"')
-             proxy_xml_content = proxy_xml_content.replace('name="kodi forbxy Add-on repository"', 'name="kodi forbxy Add-on repository (GHProxy)"')
-             
-             # Prepend gh-proxy
-             # Pattern: https://raw.githubusercontent.com
-             proxy_xml_content = proxy_xml_content.replace('https://raw.githubusercontent.com', 'https://gh-proxy.org/https://raw.githubusercontent.com')
-             
-             # Specifically replace the checksum link for ghproxy
-             proxy_xml_content = proxy_xml_content.replace('https://gh-proxy.org/https://raw.githubusercontent.com/forbxy/repository.forbxy/master/addons.xml.md5', 'https://kodi8.com/addons.xml.md5')
-             proxy_xml_content = proxy_xml_content.replace('https://gh-proxy.org/https://raw.githubusercontent.com/forbxy/repository.forbxy/master/addons.xml', 'https://kodi8.com/addons.xml')
-             
-             # Extract verify info
-             root = ET.fromstring(proxy_xml_content)
-             repo_id = root.get('id')
-             repo_version = root.get('version')
-             
-             if repo_id and repo_version:
-                repo_zip_name = f"{repo_id}-{repo_version}.zip"
-                # Ensure repo directory exists
-                if not os.path.exists(repo_id):
-                    os.makedirs(repo_id)
-                
-                # Write modified addon.xml temporarily
-                temp_proxy_xml = f"{repo_id}/addon.xml"
-                with open(temp_proxy_xml, "w", encoding="utf-8") as f:
-                    f.write(proxy_xml_content)
-                
-                repo_zip_path = os.path.join(repo_id, repo_zip_name)
-                print(f"Creating proxy repository zip: {repo_zip_path}")
-                
-                with zipfile.ZipFile(repo_zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                     zf.write(temp_proxy_xml, f"{repo_id}/addon.xml")
-                     
-                     # Also include icon/fanart if they exist
-                     for extra in ['icon.png', 'icon.jpg', 'fanart.jpg']:
-                         if os.path.exists(extra):
-                             zf.write(extra, f"{repo_id}/{extra}")
-                             # Also copy to disk for direct access if needed
-                             import shutil
-                             if not os.path.exists(f"{repo_id}/{extra}"):
-                                 shutil.copy2(extra, f"{repo_id}/{extra}")
-                
-                # Copy zip to root for flat access
-                root_zip_path = repo_zip_name
-                import shutil
-                shutil.copy2(repo_zip_path, root_zip_path)
-
-                # Clean up temp xml
-                if os.path.exists(temp_proxy_xml):
-                    os.remove(temp_proxy_xml)
-                             
-                # Add proxy repo to addons.xml list
-                lines = proxy_xml_content.splitlines()
-                if lines[0].startswith("<?xml"):
-                    proxy_xml_content = "\n".join(lines[1:])
-                addons_xml += proxy_xml_content.strip() + "\n"
+            root = make_repository_variant(template, mirror, compressed_index, SHARD_SCHEMES[shards] if shards else None)
+            repo_id = root.get('id')
+            repo_version = root.get('version')
+            if not (repo_id and repo_version):
+                continue
+
+            repo_xml_content = ET.tostring(root, encoding='unicode')
+            repo_zip_name = f"{repo_id}-{repo_version}.zip"
+            repo_zip_path = os.path.join(repo_id, repo_zip_name)
+            # Ensure the zip is also copied to root for flat index.html access
+            root_zip_path = repo_zip_name
+
+            entries = {f"{repo_id}/addon.xml": (XML_DECLARATION + repo_xml_content + "\n").encode("utf-8")}
+            # Also include icon/fanart if they exist
+            for extra in extras:
+                entries[f"{repo_id}/{extra}"] = extra
+                # Also copy to disk for direct access if needed
+                local_extra = os.path.join(repo_id, extra)
+                if not os.path.isfile(local_extra) or not filecmp.cmp(extra, local_extra, shallow=False):
+                    publisher.copy(extra, local_extra)
+
+            # Deterministic zip, only rebuilt when addon.xml or the icons changed
+            digest, built = build_zip(repo_zip_path, entries, publisher)
+            print(f"{'Creating' if built else 'Unchanged'} repository zip: {repo_zip_path}")
+
+            # Copy zip to root for flat access
+            if get_zip_digest(root_zip_path) != digest:
+                publisher.copy(repo_zip_path, root_zip_path)
+
+            # Also Add repo itself to addons.xml
+            fragments.append(repo_xml_content.strip() + "\n")
+
         except Exception as e:
-            print(f"Error processing proxy repository: {e}")
+            print(f"Error packing repository addon{mirror.get('id_suffix', '')}: {e}")
+
+    return fragments
+
+def write_index_html(publisher, root=None):
+    """Writes the root index.html. root is the repo_scan.DirectoryListing of ".", scanned here if not given."""
+    if root is None:
+        root = scan_directory(".")
 
-    addons_xml += "</addons>\n"
-    
-    # Write addons.xml first
-    with open("addons.xml", "w", encoding="utf-8") as f:
-        f.write(addons_xml)
-    
-    # Calculate MD5 from the file content on disk to ensure consistency
-    hash_md5 = hashlib.md5()
-    with open("addons.xml", "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    
-    md5 = hash_md5.hexdigest()
-    
-    with open("addons.xml.md5", "w", encoding="utf-8") as f:
-        f.write(md5)
-        
-    print(f"Generated addons.xml (MD5: {md5})")
-    
     # Generate index.html for Kodi File Manager Source
     # Lists only the repository zip files for easy installation
     # User requested a friendly page with descriptions (Bilingual)
@@ -438,51 +852,312 @@ Proxy version, uses gh-proxy.com links.
 <hr>
 <pre>
 """
-    
-    # Generate sub-directory indices
-    try:
-        import create_directory_indices
-        create_directory_indices.create_directory_indices()
-    except ImportError:
-        print("Could not import create_directory_indices.py, skipping sub-directory index generation.")
 
     # Find all repository zips we just created (now also in root)
     repo_zips = []
-    
-    # We look for the zips in the root directory
-    for f in os.listdir("."):
+
+    # We look for the zips in the root directory, including the ones staged in this run
+    staged = publisher.staged_files(".")
+    for f in set(root.files) | set(staged):
         if f.endswith(".zip") and f.startswith("repository.forbxy"):
             repo_zips.append(f)
-            
+
     # Sort them to be nice
     repo_zips.sort()
-                
+
     for zip_path in repo_zips:
         filename = os.path.basename(zip_path)
-        size_bytes = os.path.getsize(zip_path)
+        size_bytes = os.path.getsize(staged[filename]) if filename in staged else root.files[filename].size
         # Format: <a href="filename">filename</a>        Size
         # Using <pre> block for alignment
         index_html += f'<a href="{filename}">{filename}</a>{" " * (50 - len(filename))}{size_bytes} bytes<br>\n'
 
-    # Add directories link
-    dirs = [d for d in os.listdir('.') if os.path.isdir(d) and not d.startswith('.') and d != '.git' and d != '.github' and d != '__pycache__']
-    dirs.sort()
-    
+    # Add directories link (hidden ones like .git and .github are not in the scan)
+    dirs = sorted(root.subdirs)
+
     for d in dirs:
         display_name = d + "/"
         # Simple alignment
         space_len = 50 - len(display_name)
         space = " " * space_len if space_len > 0 else " "
         index_html += f'<a href="{display_name}">{display_name}</a>{space}-<br>\n'
-        
+
     index_html += """</pre>
 <hr>
 </body>
 </html>
 """
-    with open("index.html", "w", encoding="utf-8") as f:
-        f.write(index_html)
-    print("Generated index.html")
+    if publisher.write_if_changed("index.html", index_html.encode("utf-8")):
+        print("Generated index.html")
+    else:
+        print("Unchanged index.html")
+
+def generate_repo(cache_path=BUILD_CACHE_FILE, jobs=1, xz=False, compressed_index=False, report=None, index_state=None, shards=None,
+                  changed_since=None):
+    """
+    Full build of addons.xml, the repository addons, checksums and index pages.
+    With changed_since (a git revision) only the directories git reports as changed since
+    then are processed, the others keep their addons.xml fragment, checksums and index
+    pages from the previous run.
+    With shards (a key of SHARD_SCHEMES) addons.xml is also split into addons-<shard>.xml
+    files, which the repository addons list as separate <dir> entries. addons.xml itself is
+    still written for installed repository addons that don't know the shards yet.
+    index_state, if given, receives what update_addon_dirs() needs to rebuild single
+    directories afterwards: the fragment per directory, the repository addon fragments,
+    the build manifest and the hash cache.
+    """
+    # Timings and counters are always collected, they are only written out with --report
+    if report is None:
+        report = BuildReport("generate_repo")
+
+    # addons.xml is assembled from fragments and only joined while streaming it to disk
+    fragments = [XML_DECLARATION + "<addons>\n"]
+
+    # Build manifest from the previous run. Only zips seen in this run are carried over,
+    # so entries of deleted or superseded zips drop out automatically.
+    with report.phase("load_cache"):
+        cache = load_build_cache(cache_path) if cache_path else {"version": BUILD_CACHE_VERSION, "zips": {}, "fragments": {}, "hits": 0}
+    item_fragments = {}
+    new_cache = {"version": BUILD_CACHE_VERSION, "zips": {}, "fragments": item_fragments}
+
+    # One scan of the root and every top level directory, which all outputs are rendered from
+    with report.phase("scan"):
+        scan = scan_repository()
+
+    # Process subdirectories in a stable order so the output does not depend on
+    # os.listdir order or on which worker finishes first
+    items = list(scan.dirs)
+
+    rebuild = None
+    if changed_since:
+        rebuild = get_dirs_to_rebuild(changed_since, items, cache)
+        if rebuild is not None:
+            print(f"Rebuilding {len(rebuild)} of {len(items)} directories changed since {changed_since}")
+    process_items = items if rebuild is None else [item for item in items if item in rebuild]
+
+    # Each directory only gets its own manifest entries, which keeps worker arguments small
+    item_caches = {}
+    for item in items:
+        prefix = item + "/"
+        item_caches[item] = {"zips": {k: v for k, v in cache["zips"].items() if k.startswith(prefix)}, "hits": 0}
+
+    with report.phase("addon_dirs"):
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(process_addon_dir, process_items, [item_caches[item] for item in process_items],
+                                            [scan.dirs[item] for item in process_items]))
+        else:
+            results = [process_addon_dir(item, item_caches[item], scan.dirs[item]) for item in process_items]
+
+    # Unchanged directories keep their fragment and manifest entries
+    reused_entries = 0
+    for item in items:
+        if item not in process_items:
+            item_fragments[item] = cache["fragments"][item]
+            new_cache["zips"].update(item_caches[item]["zips"])
+            reused_entries += len(item_caches[item]["zips"])
+    if rebuild is not None:
+        report.merge_counters({"fragments_reused": len(items) - len(process_items)})
+
+    for item, (fragment, cache_entries, stats) in zip(process_items, results):
+        item_fragments[item] = fragment
+        new_cache["zips"].update(cache_entries)
+        if stats.get("assets_extracted") or stats.get("assets_pruned") or stats.get("zips_built"):
+            # Files were written or removed, the directory indices have to see them
+            scan.rescan(item)
+        cache["hits"] += stats["cache_hits"]
+        report.add_item(item, stats)
+        if jobs > 1:
+            # Counted in a worker process, so not in this process' counters yet
+            report.merge_counters({k: v for k, v in stats.items() if k not in ("wall_s", "cpu_s", "cache_hits")})
+    report.merge_counters({"cache_hits": cache["hits"]})
+    fragments.extend(item_fragments[item] for item in items)
+
+    # Every published artifact is staged first and moved into place together at the end,
+    # so readers never see a half-written index or an md5 that doesn't match addons.xml
+    with Publisher() as publisher:
+        with report.phase("repository_addons"):
+            repository_fragments = package_repository_addons(publisher, compressed_index, shards=shards)
+            fragments.extend(repository_fragments)
+        fragments.append("</addons>\n")
+        with report.phase("addons_xml"):
+            publish_index(publisher, fragments, xz)
+            if shards:
+                publish_shards(publisher, fragments[1:-1], shards, xz)
+
+        # A .sha256 next to every zip, for repositories with <hashes>sha256</hashes>.
+        # Shares the hash cache with index.json, so every zip is hashed at most once.
+        hash_cache = HashCache(HASH_CACHE_FILE if cache_path else None)
+        # The repository addons of new mirrors (or all of them on a fresh tree) were just
+        # created and need sidecars, indices and a link in index.html like the others
+        new_dirs = scan.add_new_directories()
+        directories = ["."] + (items if rebuild is None else process_items) + new_dirs
+        with report.phase("checksums"):
+            # Before the indices are listed, so they don't show checksums of deleted zips
+            remove_orphaned_sidecars(directories, publisher, scan)
+            changed = publish_zip_sidecars(publisher, hash_cache, directories, scan=scan)
+            print(f"Zip checksums: {changed} updated")
+
+        # Generate sub-directory indices
+        with report.phase("directory_indices"):
+            try:
+                import create_directory_indices
+                create_directory_indices.create_directory_indices(publisher, hash_cache, directories[1:], scan)
+            except ImportError:
+                print("Could not import create_directory_indices.py, skipping sub-directory index generation.")
+
+        with report.phase("index_html"):
+            write_index_html(publisher, scan.root)
+
+        with report.phase("commit"):
+            publisher.commit()
+
+    if cache_path:
+        with report.phase("save_cache"):
+            save_build_cache(new_cache, cache_path)
+            # After a partial build the entries of the directories that were skipped stay
+            hash_cache.save(prune=rebuild is None)
+        print(f"Build cache: {cache['hits']} unchanged, {len(new_cache['zips']) - reused_entries - cache['hits']} re-read"
+              + (f", {len(items) - len(process_items)} directories skipped" if rebuild is not None else ""))
+
+    if index_state is not None:
+        index_state["addons"] = item_fragments
+        index_state["repository"] = repository_fragments
+        index_state["cache"] = new_cache
+        index_state["hash_cache"] = hash_cache
+        index_state["shards"] = shards
+
+    return report
+
+def update_addon_dirs(items, index_state, cache_path=BUILD_CACHE_FILE, xz=False):
+    """
+    Rebuilds only the addon directories in items after generate_repo(index_state=...)
+    ran: their fragments are spliced into the ones kept from the full build, addons.xml
+    is only rewritten if one of them changed, and only their checksums and index pages
+    are refreshed. Directories in items that no longer exist are dropped.
+    Of a sharded index only the shards of changed fragments are rewritten.
+    """
+    cache = index_state["cache"]
+    addons = index_state["addons"]
+    scheme = index_state["shards"]
+    index_changed = False
+    directories_changed = False
+    changed_shards = set()
+
+    for item in items:
+        prefix = item + "/"
+        item_cache = {"zips": {k: v for k, v in cache["zips"].items() if k.startswith(prefix)}, "hits": 0}
+        for key in item_cache["zips"]:
+            del cache["zips"][key]
+
+        if os.path.isdir(item):
+            fragment, cache_entries, stats = process_addon_dir(item, item_cache)
+            cache["zips"].update(cache_entries)
+            directories_changed |= item not in addons
+            previous = addons.get(item, "")
+            if previous != fragment:
+                index_changed = True
+                if scheme:
+                    changed_shards.update((get_shard(previous, scheme), get_shard(fragment, scheme)))
+            addons[item] = fragment
+        elif item in addons:
+            print(f"Removed {item}")
+            previous = addons.pop(item)
+            if previous:
+                index_changed = True
+                if scheme:
+                    changed_shards.add(get_shard(previous, scheme))
+            directories_changed = True
+
+    existing = [item for item in items if os.path.isdir(item)]
+    with Publisher() as publisher:
+        if index_changed:
+            fragments = [XML_DECLARATION + "<addons>\n"]
+            fragments.extend(addons[item] for item in sorted(addons))
+            fragments.extend(index_state["repository"])
+            fragments.append("</addons>\n")
+            publish_index(publisher, fragments, xz)
+            if scheme:
+                publish_shards(publisher, fragments[1:-1], scheme, xz, changed_shards)
+
+        hash_cache = index_state["hash_cache"]
+        remove_orphaned_sidecars(existing, publisher)
+        publish_zip_sidecars(publisher, hash_cache, existing)
+
+        import create_directory_indices
+        create_directory_indices.create_directory_indices(publisher, hash_cache, existing)
+
+        # The root index.html links every directory
+        if directories_changed:
+            write_index_html(publisher)
+
+    if cache_path:
+        save_build_cache(cache, cache_path)
+        hash_cache.save()
+
+def is_generated_path(path):
+    """Paths (relative to the repository root) written by the build itself, which --watch ignores."""
+    name = os.path.basename(path)
+    return (name.startswith(".") or name == "__pycache__" or name in ("index.html", "index.json")
+            or name.endswith((".md5", ".sha256")) or (os.path.dirname(path) == "" and name.startswith("addons")))
+
+def watch_repo(cache_path=BUILD_CACHE_FILE, jobs=1, xz=False, compressed_index=False, shards=None, debounce=DEFAULT_DEBOUNCE):
+    """
+    Builds the repository once, then waits for changes and rebuilds only the addon
+    directories they touch. Changes to the repository addon inputs in the root, or
+    lost events, trigger another full build. Runs until interrupted.
+    """
+    index_state = {}
+    generate_repo(cache_path, jobs, xz, compressed_index, index_state=index_state, shards=shards)
+
+    with open_watcher(".", is_generated_path) as watcher:
+        print(f"Watching for changes ({watcher.kind}), press Ctrl+C to stop")
+        try:
+            while True:
+                changes = wait_for_changes(watcher, debounce)
+                full_build = RESCAN in changes
+                items = set()
+                for path in changes:
+                    top = path.split(os.sep)[0]
+                    if top in REPOSITORY_INPUTS:
+                        full_build = True
+                    elif os.path.isdir(top) or top in index_state["addons"]:
+                        items.add(top)
+
+                if not full_build and not items:
+                    continue
+                start = time.perf_counter()
+                if full_build:
+                    generate_repo(cache_path, jobs, xz, compressed_index, index_state=index_state, shards=shards)
+                else:
+                    update_addon_dirs(sorted(items), index_state, cache_path, xz)
+                print(f"Updated {'everything' if full_build else ', '.join(sorted(items))} in {(time.perf_counter() - start) * 1000:.0f} ms")
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == "__main__":
-    generate_repo()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate addons.xml, checksums and index pages for the repository")
+    parser.add_argument("--no-cache", action="store_true", help=f"ignore and do not write the {BUILD_CACHE_FILE} build manifest and the {HASH_CACHE_FILE} hash cache")
+    parser.add_argument("--jobs", "-j", type=int, default=1, metavar="N", help="process addon directories in N worker processes")
+    parser.add_argument("--xz", action="store_true", help="also write addons.xml.xz and addons.xml.xz.md5")
+    parser.add_argument("--compressed-index", action="store_true", help="point the repository addons at addons.xml.gz instead of addons.xml")
+    parser.add_argument("--report", metavar="FILE", help="write wall/CPU time per phase and per addon directory and I/O counters to FILE as JSON")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and write the stats to FILE (only the main process with --jobs)")
+    parser.add_argument("--shards", choices=sorted(SHARD_SCHEMES), help="also split addons.xml into addons-<shard>.xml files, by platform (plain/binary) or by addon type, "
+                        "and give the repository addons one <dir> per shard (bump their version when turning this on)")
+    parser.add_argument("--changed-since", metavar="REV", help="only process the directories git reports as changed since REV and reuse the previous "
+                        "addons.xml entries of the others; the root addon.xml or the scripts changing triggers a full build")
+    parser.add_argument("--watch", action="store_true", help="after the build, keep watching for changes and rebuild only the addon directories they touch")
+    args = parser.parse_args()
+
+    if args.watch:
+        watch_repo(cache_path=None if args.no_cache else BUILD_CACHE_FILE, jobs=args.jobs, xz=args.xz,
+                   compressed_index=args.compressed_index, shards=args.shards)
+    else:
+        report = BuildReport("generate_repo")
+        with profiled(args.profile):
+            generate_repo(cache_path=None if args.no_cache else BUILD_CACHE_FILE, jobs=args.jobs, xz=args.xz,
+                          compressed_index=args.compressed_index, report=report, shards=args.shards,
+                          changed_since=args.changed_since)
+        if args.report:
+            report.write(args.report)
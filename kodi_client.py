@@ -0,0 +1,257 @@
+import os
+import re
+import sys
+import gzip
+import lzma
+import json
+import time
+import argparse
+import statistics
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from repo_scan import parse_zip_filename
+
+# supportedPlatforms as Kodi builds report them (CAddonInfoBuilder::PlatformSupportsAddon in
+# xbmc/addons/addoninfo). Written down from Kodi, not from update_repo.STANDARD_PLATFORMS, so a
+# platform name the publisher gets wrong shows up as an addon no client can install.
+CLIENTS = {
+    "android-aarch64": ["all", "android", "android-aarch64"],
+    "android-armv7": ["all", "android", "android-armv7"],
+    "linux-aarch64": ["all", "linux", "linux-aarch64"],
+    "linux-armv7": ["all", "linux", "linux-armv7"],
+    "linux-i686": ["all", "linux", "linux-i686"],
+    "linux-x86_64": ["all", "linux", "linux-x86_64"],
+    # Desktop builds also report the legacy "windx"
+    "windows-i686": ["all", "windx", "windows", "windows-i686"],
+    "windows-x86_64": ["all", "windx", "windows", "windows-x86_64"],
+    "osx-x86_64": ["all", "osx", "osx64", "osx-x86_64"],
+    "osx-arm64": ["all", "osx", "osxarm64", "osx-arm64"],
+    "ios-aarch64": ["all", "ios", "ios-aarch64"],
+    # CoreELEC Amlogic-ng: 32-bit userland built with -march=armv8-a, __ARM_ARCH_7A__ is not
+    # defined, so there is no arch tag. This is the client the "linux-armv7 linux" entries are for.
+    "coreelec-armv8-32": ["all", "linux"],
+}
+
+# Every tag some Kodi build reports, including builds that are not simulated
+KODI_PLATFORM_TAGS = {tag for supported in CLIENTS.values() for tag in supported} | {
+    "android-i686", "android-x86_64", "freebsd", "windowsstore", "tvos", "tvos-aarch64",
+}
+
+# Index sizes of the parse benchmark, as multiples of the addons in the real index
+DEFAULT_SCALES = [1, 4, 16, 64]
+
+REPORT_VERSION = 1
+
+
+def load_index(index_path):
+    """Bytes of an addons.xml, decompressed the way Kodi does for <info compressed="true">."""
+    opener = {".gz": gzip.open, ".xz": lzma.open}.get(os.path.splitext(index_path)[1], open)
+    with opener(index_path, "rb") as f:
+        return f.read()
+
+
+def get_version_key(version):
+    """
+    Sort key for Kodi addon versions (ADDON::CAddonVersion): an optional epoch before ':',
+    then the version compared in runs of digits (as numbers) and other characters (as text).
+    """
+    epoch, _, upstream = version.lower().rpartition(':')
+    runs = []
+    for run in re.findall(r'\d+|\D+', upstream):
+        runs.append((1, int(run), "") if run.isdigit() else (0, 0, run))
+    return (int(epoch) if epoch.isdigit() else 0, tuple(runs))
+
+
+def read_entry(addon):
+    """id, version, platform tags and <path> of an <addon> element of the index."""
+    platforms = []
+    path = None
+    for extension in addon.iter('extension'):
+        if extension.get('point') != 'xbmc.addon.metadata':
+            continue
+        platform = extension.find('platform')
+        if platform is not None and platform.text:
+            platforms = platform.text.split()
+        path_element = extension.find('path')
+        if path_element is not None and path_element.text:
+            path = path_element.text.strip()
+    addon_id = addon.get('id')
+    version = addon.get('version')
+    if not path:
+        # Kodi's default: <datadir>/id/id-version.zip
+        path = f"{addon_id}/{addon_id}-{version}.zip"
+    return {"id": addon_id, "version": version, "platforms": platforms, "path": path}
+
+
+def read_entries(index):
+    """Every <addon> of an addons.xml in document order."""
+    return [read_entry(addon) for addon in ET.fromstring(index).findall('addon')]
+
+
+def resolve(entries, supported):
+    """
+    The entry a client with supportedPlatforms `supported` installs, per addon id.
+    Entries without a supported platform are dropped (CAddonInfoBuilder::PlatformSupportsAddon,
+    an empty <platform> supports every client). Of the rest the highest version wins and,
+    because AddAddonIfLatest only replaces on a strictly greater version, the first
+    entry in the index wins among equal versions.
+    """
+    latest = {}
+    keys = {}
+    for entry in entries:
+        if entry["platforms"] and not any(tag in supported for tag in entry["platforms"]):
+            continue
+        key = get_version_key(entry["version"] or "0")
+        if entry["id"] not in latest or key > keys[entry["id"]]:
+            latest[entry["id"]] = entry
+            keys[entry["id"]] = key
+    return latest
+
+
+def check_entry(entry, supported, repo_root):
+    """Problem with the zip a client resolved to, or None."""
+    if repo_root is not None and not os.path.isfile(os.path.join(repo_root, entry["path"])):
+        return "missing zip"
+    parsed = parse_zip_filename(os.path.basename(entry["path"]))
+    # Only clients with an arch tag can tell a wrong binary, "all linux" takes any linux zip
+    arch_tags = [tag for tag in supported if '-' in tag]
+    if parsed and parsed[2] != "all" and arch_tags and parsed[2] not in supported:
+        return f"wrong binary for {arch_tags[-1]}"
+    return None
+
+
+def simulate_clients(entries, repo_root, show_all=False):
+    """
+    Prints what every client in CLIENTS resolves, by default only for binary addons
+    (addons with more than one entry or a platform other than "all").
+    Returns the number of problems found.
+    """
+    counts = {}
+    for entry in entries:
+        counts[entry["id"]] = counts.get(entry["id"], 0) + 1
+    binary = {entry["id"] for entry in entries if counts[entry["id"]] > 1 or entry["platforms"] not in ([], ["all"])}
+
+    problems = 0
+    unknown = sorted({tag for entry in entries for tag in entry["platforms"]} - KODI_PLATFORM_TAGS)
+    for tag in unknown:
+        # Published, but no Kodi build will ever install it
+        print(f"Platform {tag} is not reported by any Kodi build")
+        problems += 1
+
+    for client, supported in CLIENTS.items():
+        resolved = resolve(entries, supported)
+        print(f"{client} ({' '.join(supported)}):")
+        for addon_id in sorted(binary if not show_all else counts):
+            entry = resolved.get(addon_id)
+            if entry is None:
+                print(f"  {addon_id}: not available")
+                continue
+            problem = check_entry(entry, supported, repo_root)
+            if problem:
+                problems += 1
+            platforms = ' '.join(entry["platforms"]) or "-"
+            print(f"  {addon_id} {entry['version']} [{platforms}] {entry['path']}" + (f"  <-- {problem}" if problem else ""))
+    return problems
+
+
+def scale_index(entries_xml, scale):
+    """addons.xml with `scale` copies of every addon, the copies get a numbered id suffix."""
+    parts = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<addons>\n']
+    for copy_number in range(scale):
+        for addon_id, xml in entries_xml:
+            if copy_number:
+                xml = xml.replace(f'id="{addon_id}"', f'id="{addon_id}.copy{copy_number}"', 1)
+            parts.append(xml)
+    parts.append('</addons>\n')
+    return "".join(parts).encode("utf-8")
+
+
+def benchmark_parse(index, scales, repeat, client):
+    """
+    Parse time and peak memory of growing indices, made from the addons of index.
+    Time is the median of `repeat` runs of parsing plus resolving for client, memory the
+    peak of the Python heap while doing so (tracemalloc, measured in a separate run because
+    tracing slows allocation down). Kodi parses with TinyXML, so the numbers are for
+    comparing index sizes and revisions, not absolute figures for a device.
+    """
+    root = ET.fromstring(index)
+    entries_xml = [(addon.get('id'), ET.tostring(addon, encoding='unicode')) for addon in root.findall('addon')]
+
+    results = []
+    for scale in scales:
+        data = scale_index(entries_xml, scale)
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            resolve(read_entries(data), CLIENTS[client])
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            resolve(read_entries(data), CLIENTS[client])
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            "scale": scale,
+            "entries": len(entries_xml) * scale,
+            "bytes": len(data),
+            "xz_bytes": len(lzma.compress(data)),
+            "parse_s": round(statistics.median(timings), 6),
+            "peak_kb": peak // 1024,
+        }
+        results.append(result)
+        print(f"{result['entries']:>7} entries {result['bytes']:>11} bytes ({result['xz_bytes']} xz): "
+              f"{result['parse_s'] * 1000:.1f} ms, peak {result['peak_kb']} KB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve a generated addons.xml the way Kodi clients do, per platform, "
+                                                 "and benchmark how parsing it scales")
+    parser.add_argument("--index", default="addons.xml", help="addons.xml to load, .gz and .xz are decompressed (default: addons.xml)")
+    parser.add_argument("--all", action="store_true", help="show every addon, not only binary ones")
+    parser.add_argument("--no-file-check", action="store_true", help="do not check that the resolved zips exist next to the index")
+    parser.add_argument("--benchmark", action="store_true", help="measure parse time and memory of the index and of larger copies of it")
+    parser.add_argument("--scales", default=",".join(str(s) for s in DEFAULT_SCALES), metavar="N,N,...",
+                        help=f"index sizes for --benchmark, as multiples of the real index (default: {','.join(str(s) for s in DEFAULT_SCALES)})")
+    parser.add_argument("--repeat", type=int, default=5, metavar="N", help="runs per size, the median is reported (default: 5)")
+    parser.add_argument("--client", default="linux-armv7", choices=sorted(CLIENTS), help="client resolved in --benchmark (default: linux-armv7)")
+    parser.add_argument("--output", "-o", metavar="FILE", help="write the resolutions and benchmark results as JSON to FILE")
+    args = parser.parse_args()
+
+    try:
+        scales = [int(s) for s in args.scales.split(",")]
+    except ValueError:
+        parser.error("--scales must be a comma separated list of integers")
+    if args.repeat < 1 or min(scales) < 1:
+        parser.error("--repeat and --scales must be at least 1")
+
+    index = load_index(args.index)
+    entries = read_entries(index)
+    repo_root = None if args.no_file_check else os.path.dirname(os.path.abspath(args.index))
+    problems = simulate_clients(entries, repo_root, args.all)
+
+    report = {
+        "version": REPORT_VERSION,
+        "index": args.index,
+        "clients": {client: {addon_id: entry["path"] for addon_id, entry in sorted(resolve(entries, supported).items())}
+                    for client, supported in CLIENTS.items()},
+        "problems": problems,
+    }
+    if args.benchmark:
+        print(f"Parse benchmark ({args.client}):")
+        report["benchmark"] = benchmark_parse(index, scales, args.repeat, args.client)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote {args.output}")
+
+    if problems:
+        print(f"{problems} problems found")
+        sys.exit(1)
@@ -0,0 +1,72 @@
+import os
+import argparse
+
+from checksums import SIDECAR_EXTENSION
+from repo_scan import parse_zip_filename, get_version_key
+
+
+def find_old_versions(keep):
+    """
+    Returns the paths of addon zips that are older than the newest `keep` versions
+    of their addon and platform, e.g. vfs.stream.fast windows-x86_64 and osx-arm64
+    zips are counted separately. Zips without a recognizable version are never returned.
+    """
+    old_versions = []
+    for item in sorted(os.listdir(".")):
+        if not os.path.isdir(item) or item.startswith('.'):
+            continue
+
+        groups = {}
+        for file in os.listdir(item):
+            if not file.endswith('.zip'):
+                continue
+            parsed = parse_zip_filename(file)
+            if not parsed:
+                continue
+            addon_id, version, platform = parsed
+            groups.setdefault((addon_id, platform), []).append(file)
+
+        for key in sorted(groups):
+            files = sorted(groups[key], key=get_version_key, reverse=True)
+            old_versions.extend(os.path.join(item, file) for file in files[keep:])
+
+    return old_versions
+
+
+def prune_old_versions(keep, dry_run=False):
+    """
+    Deletes addon zips beyond the newest `keep` versions per addon and platform and
+    regenerates the per-directory index.html files.
+    With dry_run only reports what would be deleted.
+    """
+    if keep < 1:
+        raise ValueError("keep must be at least 1, the newest version is always published")
+
+    old_versions = find_old_versions(keep)
+    total_size = 0
+    for path in old_versions:
+        size = os.path.getsize(path)
+        total_size += size
+        print(f"{'Would remove' if dry_run else 'Removing'} {path} ({size} bytes)")
+        if not dry_run:
+            os.remove(path)
+            # Checksum written by generate_repo.py
+            if os.path.exists(path + SIDECAR_EXTENSION):
+                os.remove(path + SIDECAR_EXTENSION)
+
+    print(f"{'Would remove' if dry_run else 'Removed'} {len(old_versions)} old zips, {total_size} bytes (keeping {keep} per addon and platform)")
+
+    if old_versions and not dry_run:
+        import create_directory_indices
+        create_directory_indices.create_directory_indices()
+
+    return old_versions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete old addon zips, keeping the newest versions of every addon and platform")
+    parser.add_argument("--keep", type=int, default=3, metavar="N", help="number of versions to keep per addon and platform (default: 3)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    args = parser.parse_args()
+
+    prune_old_versions(args.keep, dry_run=args.dry_run)
@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+
+from build_report import count
+
+# Checksum files are moved into place after everything else, so a reader that
+# sees a new checksum also sees the file it was computed from.
+CHECKSUM_EXTENSIONS = (".md5", ".sha256")
+
+
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def write_json_atomic(path, data, ensure_ascii=True):
+    """
+    Writes data as JSON to path through a temp file, so an interrupted run never
+    leaves a truncated file behind. For the caches and state files of the scripts.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True, ensure_ascii=ensure_ascii)
+        f.write("\n")
+    os.replace(temp_path, path)
+
+
+class StagedFile:
+    """
+    Binary file written to a temp path. Everything written is hashed on the fly,
+    so checksums never need a second read of the file.
+    """
+
+    def __init__(self, temp_path, hash_names=()):
+        self.temp_path = temp_path
+        self.size = 0
+        self._file = open(temp_path, "wb")
+        self._hashes = {name: hashlib.new(name) for name in hash_names}
+
+    def write(self, data):
+        self._file.write(data)
+        for h in self._hashes.values():
+            h.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def hexdigest(self, name):
+        return self._hashes[name].hexdigest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class Publisher:
+    """
+    Stages build outputs in temp files next to their destination and moves them all
+    into place with os.replace in commit(). Until then the previous outputs stay
+    untouched, so the working tree can be served while it is regenerated.
+
+    Used as a context manager it commits on success and discards the staged files
+    if an exception escapes.
+    """
+
+    def __init__(self):
+        # final path -> temp path
+        self._staged = {}
+        self._file_mode = 0o666 & ~get_umask()
+
+    def stage_path(self, path):
+        """Returns a new temp path that will be moved to path on commit()."""
+        path = os.path.normpath(path)
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(prefix=".publish-", suffix=".tmp", dir=directory)
+        os.close(fd)
+        # mkstemp creates 0600 files, published files should get the usual permissions
+        os.chmod(temp_path, self._file_mode)
+
+        previous = self._staged.pop(path, None)
+        if previous:
+            os.remove(previous)
+        self._staged[path] = temp_path
+        return temp_path
+
+    def open(self, path, hash_names=()):
+        return StagedFile(self.stage_path(path), hash_names)
+
+    def write_bytes(self, path, data):
+        with self.open(path) as f:
+            f.write(data)
+
+    def write_text(self, path, text):
+        self.write_bytes(path, text.encode("utf-8"))
+
+    def write_if_changed(self, path, data):
+        """
+        Stages data for path unless path already has exactly this content, so unchanged
+        files keep their mtime. Returns True if it was staged.
+        """
+        current = self.resolve(path)
+        try:
+            if os.path.getsize(current) == len(data):
+                with open(current, "rb") as f:
+                    if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                        return False
+        except OSError:
+            pass
+        self.write_bytes(path, data)
+        return True
+
+    def copy(self, src, path):
+        shutil.copyfile(self.resolve(src), self.stage_path(path))
+
+    def resolve(self, path):
+        """Path to read the current content of path from, staged or on disk."""
+        return self._staged.get(os.path.normpath(path), path)
+
+    def exists(self, path):
+        return os.path.normpath(path) in self._staged or os.path.exists(path)
+
+    def getsize(self, path):
+        return os.path.getsize(self.resolve(path))
+
+    def listdir(self, directory="."):
+        """os.listdir() including files that are staged but not committed yet."""
+        names = set(os.listdir(directory))
+        names.update(self.staged_files(directory))
+        return list(names)
+
+    def staged_files(self, directory="."):
+        """Name -> temp path of the files staged in directory."""
+        directory = os.path.normpath(directory)
+        return {os.path.basename(path): temp_path for path, temp_path in self._staged.items()
+                if (os.path.dirname(path) or ".") == directory}
+
+    def commit(self):
+        for path in sorted(self._staged, key=lambda p: p.endswith(CHECKSUM_EXTENSIONS)):
+            count("files_published")
+            count("bytes_written", os.path.getsize(self._staged[path]))
+            os.replace(self._staged[path], path)
+        self._staged = {}
+
+    def discard(self):
+        for temp_path in self._staged.values():
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        self._staged = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
@@ -0,0 +1,141 @@
+import os
+import re
+
+# Operating system keywords in the names of platform zips written by update_repo.py
+PLATFORM_KEYWORDS = ('android', 'windows', 'linux', 'osx', 'ios')
+
+
+def is_hidden(name):
+    """Hidden from every output: dot files and directories (.git, caches, temp files) and Python caches."""
+    return name.startswith('.') or name == '__pycache__'
+
+
+def parse_zip_filename(filename):
+    """
+    Splits an addon zip name into (addon_id, version, platform).
+    Typical formats: addon.id-1.2.3.zip and, from update_repo.py, addon.id-1.2.3-windows-x86_64.zip.
+    The version is the first hyphen separated part that looks like X.Y.Z (addon ids may contain
+    hyphens too), platform is 'all' when nothing follows it. Returns None if no version is found.
+    """
+    base = filename[:-4] if filename.endswith('.zip') else filename
+    parts = base.split('-')
+    for i in range(1, len(parts)):
+        if re.match(r'^\d+(\.\d+)+[a-z0-9]*$', parts[i]):
+            return '-'.join(parts[:i]), parts[i], '-'.join(parts[i + 1:]) or 'all'
+    return None
+
+
+def get_version_key(filename):
+    """
+    Sort key ordering addon zips by version.
+    Versions compare as tuples of ints (1.10 > 1.2) followed by the suffix (1.2.3a > 1.2.3).
+    Names without a recognizable version sort below all versioned ones.
+    """
+    parsed = parse_zip_filename(filename)
+    if not parsed:
+        return (0, (), "", filename)
+
+    match = re.match(r'^([\d\.]+)(.*)$', parsed[1])
+    numbers = tuple(int(x) for x in match.group(1).split('.') if x)
+    return (1, numbers, match.group(2), filename)
+
+
+def is_platform_zip(filename):
+    # pattern: ID-Version-Platform.zip, standard is ID-Version.zip.
+    # Relies on the update_repo.py naming convention.
+    return len(filename[:-4].split('-')) > 2 and any(keyword in filename for keyword in PLATFORM_KEYWORDS)
+
+
+class FileEntry:
+    """A file found by the scan, with size and mtime from one stat. Zips also carry their parsed name."""
+    __slots__ = ("name", "size", "mtime_ns", "parsed", "version_key")
+
+    def __init__(self, name, size, mtime_ns):
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.parsed = None
+        self.version_key = None
+        if name.endswith('.zip'):
+            self.parsed = parse_zip_filename(name)
+            self.version_key = get_version_key(name)
+
+
+class DirectoryListing:
+    """Files (name -> FileEntry) and subdirectory names of one directory, hidden ones left out."""
+    __slots__ = ("path", "files", "subdirs")
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.subdirs = set()
+
+    def zips(self):
+        """Names of the zips in the directory, highest version first."""
+        entries = sorted((entry for entry in self.files.values() if entry.version_key is not None),
+                         key=lambda entry: entry.version_key, reverse=True)
+        return [entry.name for entry in entries]
+
+    def platform_zips(self):
+        return [name for name in self.files if name.endswith('.zip') and is_platform_zip(name)]
+
+    def remove(self, name):
+        self.files.pop(name, None)
+
+
+def scan_directory(path):
+    """DirectoryListing of path from a single os.scandir pass."""
+    listing = DirectoryListing(path)
+    with os.scandir(path) as it:
+        for entry in it:
+            if is_hidden(entry.name):
+                continue
+            if entry.is_dir():
+                listing.subdirs.add(entry.name)
+            else:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    # Removed while scanning
+                    continue
+                listing.files[entry.name] = FileEntry(entry.name, st.st_size, st.st_mtime_ns)
+    return listing
+
+
+class RepositoryScan:
+    """
+    In-memory model of the repository: the root directory and every top level directory,
+    each scanned once. addons.xml, the checksums, the root index.html and the directory
+    indices are all produced from it instead of listing the directories again.
+    """
+    __slots__ = ("root", "dirs")
+
+    def __init__(self, root, dirs):
+        self.root = root
+        # name -> DirectoryListing, sorted by name
+        self.dirs = dirs
+
+    def get(self, directory):
+        """DirectoryListing of "." or of a top level directory."""
+        return self.root if directory == "." else self.dirs[directory]
+
+    def rescan(self, directory):
+        """Scans a top level directory again after the build changed files in it."""
+        if os.path.isdir(directory):
+            self.dirs[directory] = scan_directory(directory)
+        else:
+            self.dirs.pop(directory, None)
+
+    def add_new_directories(self):
+        """Scans the top level directories created since the scan, e.g. by a publisher. Returns their names."""
+        added = sorted(scan_directory(".").subdirs - self.root.subdirs)
+        for name in added:
+            self.root.subdirs.add(name)
+            self.dirs[name] = scan_directory(name)
+        return added
+
+
+def scan_repository():
+    """RepositoryScan of the current directory."""
+    root = scan_directory(".")
+    return RepositoryScan(root, {name: scan_directory(name) for name in sorted(root.subdirs)})
@@ -0,0 +1,343 @@
+import os
+import json
+import html
+import asyncio
+import argparse
+import mimetypes
+import email.utils
+from http import HTTPStatus
+from urllib.parse import unquote, quote
+
+from generate_repo import BUILD_CACHE_FILE
+
+# Requests are small, anything bigger than this is not a Kodi client
+MAX_HEADER_SIZE = 64 * 1024
+# Idle keep-alive connections are closed after this many seconds
+KEEP_ALIVE_TIMEOUT = 30
+
+# Served gzip encoded when the client accepts it and name + ".gz" exists, e.g. addons.xml.gz.
+# Shards of addons.xml (addons-<shard>.xml) as well.
+PRECOMPRESSED_FILES = ('addons.xml', 'index.html')
+
+CONTENT_TYPES = {
+    '.zip': 'application/zip',
+    '.xml': 'text/xml; charset=utf-8',
+    '.html': 'text/html; charset=utf-8',
+    '.md5': 'text/plain; charset=utf-8',
+    '.sha256': 'text/plain; charset=utf-8',
+    '.gz': 'application/gzip',
+    '.xz': 'application/x-xz',
+}
+
+
+class NotModified(Exception):
+    pass
+
+
+def get_content_type(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in CONTENT_TYPES:
+        return CONTENT_TYPES[extension]
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def parse_range(header, size):
+    """
+    Parses a single "bytes=start-end" range. Returns (start, end) inclusive,
+    None to serve the whole file (no range, multiple ranges or a malformed header),
+    or False if the range can't be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if start == '':
+            # Suffix range: the last `end` bytes
+            length = int(end)
+            if length == 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def etag_matches(header, etag):
+    """If-None-Match comparison, weak as RFC 9110 prescribes for GET and HEAD."""
+    if header.strip() == '*':
+        return True
+    return any(candidate.strip().removeprefix('W/') == etag for candidate in header.split(','))
+
+
+class ETagSource:
+    """
+    Strong ETags for files of the repository tree:
+      - the .md5 file written next to addons.xml and its compressed variants,
+      - the .sha256 file written next to every zip,
+      - the central directory CRC from the build manifest for addon zips,
+      - size and mtime otherwise. Files are replaced atomically by generate_repo.py, so
+        a new content always comes with a new mtime.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._manifest = {}
+        self._manifest_mtime = None
+
+    def _load_manifest(self):
+        path = os.path.join(self.root, BUILD_CACHE_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._manifest = {}
+            return
+        if mtime == self._manifest_mtime:
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._manifest = json.load(f).get("zips", {})
+        except (OSError, ValueError):
+            self._manifest = {}
+        self._manifest_mtime = mtime
+
+    def get(self, path, st):
+        for extension in ('.md5', '.sha256'):
+            checksum_path = path + extension
+            try:
+                if os.stat(checksum_path).st_mtime_ns >= st.st_mtime_ns:
+                    with open(checksum_path, "r", encoding="utf-8") as f:
+                        checksum = f.read().split()[0]
+                    return f'"{extension[1:]}-{checksum}"'
+            except (OSError, IndexError):
+                pass
+
+        if path.endswith('.zip'):
+            self._load_manifest()
+            key = os.path.relpath(path, self.root).replace(os.sep, '/')
+            entry = self._manifest.get(key)
+            if entry and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime_ns:
+                return f'"crc-{entry["crc"]:08x}-{st.st_size:x}"'
+
+        return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+class RepoServer:
+    """
+    Minimal HTTP/1.1 file server for the generated repository tree: GET and HEAD, keep-alive,
+    os.sendfile through loop.sendfile(), ETag/If-None-Match, If-Modified-Since, single byte
+    ranges for resuming downloads and precompressed .gz variants.
+    Dot files (.git, the build manifest, staged temp files) are never served.
+    """
+
+    def __init__(self, root=".", log=True):
+        self.root = os.path.realpath(root)
+        self.etags = ETagSource(self.root)
+        self.log = log
+
+    def resolve(self, url_path):
+        """Maps a URL path to a path in the tree, or None if it must not be served."""
+        parts = [part for part in unquote(url_path).split('/') if part]
+        if any(part.startswith('.') or '\\' in part or '\0' in part for part in parts):
+            return None
+        path = os.path.realpath(os.path.join(self.root, *parts))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return None
+        return path
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                except ValueError:
+                    await self.send_error(writer, HTTPStatus.BAD_REQUEST, keep_alive=False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, _, value = line.partition(':')
+                        headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+                if method not in ('GET', 'HEAD'):
+                    await self.send_error(writer, HTTPStatus.METHOD_NOT_ALLOWED, keep_alive=False, extra=[('Allow', 'GET, HEAD')])
+                    break
+
+                await self.serve(writer, method, target.split('?', 1)[0], headers, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, writer, method, url_path, headers, keep_alive):
+        path = self.resolve(url_path)
+        if path is None or not os.path.exists(path):
+            await self.send_error(writer, HTTPStatus.NOT_FOUND, keep_alive)
+            self.access(method, url_path, HTTPStatus.NOT_FOUND)
+            return
+
+        if os.path.isdir(path):
+            if not url_path.endswith('/'):
+                # Relative links in index pages only work below a trailing slash
+                await self.send_error(writer, HTTPStatus.MOVED_PERMANENTLY, keep_alive, extra=[('Location', quote(unquote(url_path)) + '/')])
+                self.access(method, url_path, HTTPStatus.MOVED_PERMANENTLY)
+                return
+            index_path = os.path.join(path, 'index.html')
+            if not os.path.isfile(index_path):
+                await self.send_listing(writer, method, url_path, path, keep_alive)
+                return
+            path = index_path
+
+        status, size = await self.send_file(writer, method, path, headers, keep_alive)
+        self.access(method, url_path, status, size)
+
+    async def send_file(self, writer, method, path, headers, keep_alive):
+        content_type = get_content_type(path)
+        response_headers = []
+
+        # Precompressed variant. Ranges always refer to the identity encoding here.
+        name = os.path.basename(path)
+        if name in PRECOMPRESSED_FILES or (name.startswith('addons-') and name.endswith('.xml')):
+            response_headers.append(('Vary', 'Accept-Encoding'))
+            gz_path = path + '.gz'
+            if 'gzip' in headers.get('accept-encoding', '') and 'range' not in headers and os.path.isfile(gz_path) \
+                    and os.stat(gz_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                path = gz_path
+                response_headers.append(('Content-Encoding', 'gzip'))
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            await self.send_error(writer, HTTPStatus.NOT_FOUND, keep_alive)
+            return HTTPStatus.NOT_FOUND, 0
+
+        with f:
+            st = os.fstat(f.fileno())
+            etag = self.etags.get(path, st)
+            last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+            response_headers += [
+                ('Content-Type', content_type),
+                ('ETag', etag),
+                ('Last-Modified', last_modified),
+                ('Accept-Ranges', 'bytes'),
+            ]
+
+            try:
+                self.check_conditions(headers, etag, st)
+            except NotModified:
+                # No Content-Length, a 304 may only repeat the length of the full response
+                await self.send_headers(writer, HTTPStatus.NOT_MODIFIED, response_headers, keep_alive, content_length=False)
+                return HTTPStatus.NOT_MODIFIED, 0
+
+            status = HTTPStatus.OK
+            start, end = 0, st.st_size - 1
+            if_range = headers.get('if-range')
+            if 'range' in headers and (not if_range or if_range == etag or if_range == last_modified):
+                byte_range = parse_range(headers['range'], st.st_size)
+                if byte_range is False:
+                    await self.send_error(writer, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, keep_alive,
+                                          extra=[('Content-Range', f'bytes */{st.st_size}')])
+                    return HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, 0
+                if byte_range:
+                    status = HTTPStatus.PARTIAL_CONTENT
+                    start, end = byte_range
+                    response_headers.append(('Content-Range', f'bytes {start}-{end}/{st.st_size}'))
+
+            length = end - start + 1
+            response_headers.append(('Content-Length', str(length)))
+            await self.send_headers(writer, status, response_headers, keep_alive, content_length=False)
+
+            if method == 'GET' and length > 0:
+                # os.sendfile where the platform has it, a read/write loop otherwise
+                await asyncio.get_running_loop().sendfile(writer.transport, f, start, length)
+            return status, length if method == 'GET' else 0
+
+    def check_conditions(self, headers, etag, st):
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            if etag_matches(if_none_match, etag):
+                raise NotModified()
+            return
+
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return
+            if int(st.st_mtime) <= since:
+                raise NotModified()
+
+    async def send_listing(self, writer, method, url_path, path, keep_alive):
+        """Plain index page for directories without an index.html, e.g. extracted asset folders."""
+        names = sorted(name for name in os.listdir(path) if not name.startswith('.'))
+        title = html.escape(unquote(url_path))
+        body = f"<!DOCTYPE html>\n<html>\n<head>\n<title>Index of {title}</title>\n</head>\n<body>\n<h1>Index of {title}</h1>\n<hr><pre>\n"
+        body += '<a href="../">../</a>\n'
+        for name in names:
+            display_name = name + "/" if os.path.isdir(os.path.join(path, name)) else name
+            body += f'<a href="{quote(display_name)}">{html.escape(display_name)}</a>\n'
+        body += "</pre><hr></body>\n</html>\n"
+        data = body.encode('utf-8')
+
+        await self.send_headers(writer, HTTPStatus.OK, [('Content-Type', 'text/html; charset=utf-8'), ('Content-Length', str(len(data)))],
+                                keep_alive, content_length=False)
+        if method == 'GET':
+            writer.write(data)
+            await writer.drain()
+        self.access(method, url_path, HTTPStatus.OK, len(data))
+
+    async def send_headers(self, writer, status, headers, keep_alive, content_length=True):
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}",
+                 f"Date: {email.utils.formatdate(usegmt=True)}",
+                 "Server: serve_repo"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        if content_length:
+            lines.append("Content-Length: 0")
+        lines.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+    async def send_error(self, writer, status, keep_alive, extra=()):
+        await self.send_headers(writer, status, list(extra), keep_alive)
+
+    def access(self, method, url_path, status, size=0):
+        if self.log:
+            print(f"{method} {url_path} {status.value} {size}", flush=True)
+
+
+async def serve(root=".", host="0.0.0.0", port=8000, log=True):
+    repo_server = RepoServer(root, log)
+    server = await asyncio.start_server(repo_server.handle, host, port, limit=MAX_HEADER_SIZE)
+    addresses = ", ".join(str(sock.getsockname()[:2]) for sock in server.sockets)
+    print(f"Serving {repo_server.root} on {addresses}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the generated repository over HTTP, e.g. as Kodi source or for load tests")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on (default: 0.0.0.0)")
+    parser.add_argument("--port", "-p", type=int, default=8000, help="port to listen on (default: 8000)")
+    parser.add_argument("--root", default=".", help="repository directory to serve (default: current directory)")
+    parser.add_argument("--quiet", "-q", action="store_true", help="do not log requests")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.root, args.host, args.port, log=not args.quiet))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,143 @@
+import os
+import hashlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import downloader
+from downloader import DownloadError, download_file
+
+
+class AssetHandler(BaseHTTPRequestHandler):
+    """Serves server.data with optional Range support, and can drop the first response halfway."""
+
+    def do_GET(self):
+        data = self.server.data
+        range_header = self.headers.get("Range")
+        with self.server.lock:
+            self.server.ranges_requested.append(range_header)
+            drop_after = self.server.drop_after
+            self.server.drop_after = None
+
+        start, end, status = 0, len(data) - 1, 200
+        if range_header and self.server.supports_ranges:
+            first, _, last = range_header[len("bytes="):].partition("-")
+            start = int(first)
+            end = int(last) if last else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        body = data[start:end + 1]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+
+        if drop_after is not None:
+            # Connection lost in the middle of the body
+            self.wfile.write(body[:drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(64 * 1024)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), AssetHandler)
+        self.server.data = self.data
+        self.server.supports_ranges = True
+        self.server.drop_after = None
+        self.server.ranges_requested = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/asset.zip"
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.temp_dir.name, "asset.zip")
+        self.digest = "sha256:" + hashlib.sha256(self.data).hexdigest()
+
+        # Small reads, so a dropped response leaves part of the body in the .part file.
+        # No backoff delays between retries.
+        patches = [mock.patch.object(downloader, "CHUNK_SIZE", 4096), mock.patch("downloader.time.sleep")]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def read_dest(self):
+        with open(self.dest, "rb") as f:
+            return f.read()
+
+    def test_resumes_dropped_connection(self):
+        self.server.drop_after = 20000
+        result = download_file(self.url, self.dest, size=len(self.data), digest=self.digest, log=lambda message: None)
+
+        self.assertEqual(self.read_dest(), self.data)
+        self.assertEqual(result["parts"], 1)
+        self.assertEqual(len(self.server.ranges_requested), 2)
+        self.assertIsNone(self.server.ranges_requested[0])
+        # Picks up where the .part file ended instead of starting over
+        resumed_at = int(self.server.ranges_requested[1][len("bytes="):].rstrip("-"))
+        self.assertGreater(resumed_at, 0)
+        self.assertLessEqual(resumed_at, 20000)
+
+    def test_resumes_part_file_of_earlier_call(self):
+        with open(self.dest + ".part", "wb") as f:
+            f.write(self.data[:1000])
+        result = download_file(self.url, self.dest, size=len(self.data), digest=self.digest, log=lambda message: None)
+
+        self.assertEqual(self.read_dest(), self.data)
+        self.assertEqual(result["resumed_from"], 1000)
+        self.assertEqual(self.server.ranges_requested, ["bytes=1000-"])
+
+    def test_parallel_ranges(self):
+        with mock.patch.object(downloader, "PARALLEL_MIN_SIZE", 1024):
+            result = download_file(self.url, self.dest, size=len(self.data), digest=self.digest, parts=4, log=lambda message: None)
+
+        self.assertEqual(self.read_dest(), self.data)
+        self.assertEqual(result["parts"], 4)
+        self.assertEqual(sorted(self.server.ranges_requested),
+                         sorted(f"bytes={i * 16384}-{(i + 1) * 16384 - 1}" for i in range(4)))
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), ["asset.zip"])
+
+    def test_parallel_falls_back_without_ranges(self):
+        self.server.supports_ranges = False
+        with mock.patch.object(downloader, "PARALLEL_MIN_SIZE", 1024):
+            result = download_file(self.url, self.dest, size=len(self.data), digest=self.digest, parts=4, log=lambda message: None)
+
+        self.assertEqual(self.read_dest(), self.data)
+        self.assertEqual(result["parts"], 1)
+
+    def test_digest_mismatch(self):
+        digest = "sha256:" + hashlib.sha256(b"something else").hexdigest()
+        with self.assertRaises(DownloadError):
+            download_file(self.url, self.dest, size=len(self.data), digest=digest, log=lambda message: None)
+
+        # Neither the asset nor the .part file is kept, so the next run starts over
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+    def test_size_mismatch(self):
+        with self.assertRaises(DownloadError):
+            download_file(self.url, self.dest, size=len(self.data) + 1, log=lambda message: None)
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
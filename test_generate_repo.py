@@ -0,0 +1,84 @@
+import os
+import io
+import json
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import unittest
+import contextlib
+import xml.etree.ElementTree as ET
+
+import generate_repo
+from checksums import SIDECAR_EXTENSION
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ADDON_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<addon id="plugin.video.test" name="Test" version="1.0.0" provider-name="test">
+    <extension point="xbmc.python.pluginsource" library="default.py">
+        <provides>video</provides>
+    </extension>
+    <extension point="xbmc.addon.metadata">
+        <platform>all</platform>
+    </extension>
+</addon>
+"""
+
+
+def get_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class FreshTreeTest(unittest.TestCase):
+    """First build of a tree that has no generated files yet, e.g. a new clone or a new mirror."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        for name in ("addon.xml", "icon.jpg", "mirrors.json"):
+            shutil.copyfile(os.path.join(SCRIPT_DIR, name), os.path.join(self.root, name))
+        os.makedirs(os.path.join(self.root, "plugin.video.test"))
+        with zipfile.ZipFile(os.path.join(self.root, "plugin.video.test", "plugin.video.test-1.0.0.zip"), "w") as zf:
+            zf.writestr("plugin.video.test/addon.xml", ADDON_XML)
+            zf.writestr("plugin.video.test/default.py", "print('test')\n")
+
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, self.cwd)
+        self.addCleanup(self.temp_dir.cleanup)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_repo.generate_repo(cache_path=None)
+
+        repository_id = ET.parse("addon.xml").getroot().get("id")
+        self.repository_dirs = [repository_id + mirror.get("id_suffix", "") for mirror in generate_repo.load_mirrors()]
+        self.version = ET.parse("addon.xml").getroot().get("version")
+
+    def test_repository_addons_have_sidecars_and_indices(self):
+        for directory in self.repository_dirs + ["plugin.video.test"]:
+            zips = [name for name in os.listdir(directory) if name.endswith(".zip")]
+            self.assertTrue(zips, directory)
+            with open(os.path.join(directory, "index.json"), encoding="utf-8") as f:
+                listed = {entry["name"]: entry for entry in json.load(f)["entries"]}
+            self.assertTrue(os.path.isfile(os.path.join(directory, "index.html")), directory)
+
+            for name in zips:
+                zip_path = os.path.join(directory, name)
+                with open(zip_path + SIDECAR_EXTENSION, encoding="utf-8") as f:
+                    self.assertEqual(f.read().split()[0], get_sha256(zip_path))
+                self.assertEqual(listed[name]["sha256"], get_sha256(zip_path))
+                self.assertIn(name + SIDECAR_EXTENSION, listed)
+
+    def test_root_index_links_every_directory(self):
+        with open("index.html", encoding="utf-8") as f:
+            index_html = f.read()
+        for directory in self.repository_dirs + ["plugin.video.test"]:
+            self.assertIn(f'href="{directory}/"', index_html)
+        for directory in self.repository_dirs:
+            self.assertTrue(os.path.isfile(f"{directory}-{self.version}.zip" + SIDECAR_EXTENSION))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,22 @@
 import os
 import requests
 import json
-import zipfile
 import re
 import shutil
+import queue
 import subprocess
+import tempfile
+import threading
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from build_report import BuildReport, count, profiled
+from downloader import download_file, DownloadError
+from generate_repo import parse_addon_xml
+from prune_versions import prune_old_versions
+from publish import write_json_atomic
+from zip_tools import COMPRESS_LEVEL, AddonZip, repack_addon_zip
 
 STANDARD_PLATFORMS = [
     'android-aarch64',
@@ -20,6 +32,14 @@ STANDARD_PLATFORMS = [
     'ios-arm64'
 ]
 
+# Last seen tag and assets per repo. Lets unchanged releases be skipped after a single metadata query.
+RELEASE_STATE_FILE = ".release-state.json"
+
+# Assets of one release downloaded at the same time, and how many finished downloads may
+# wait for inspection before further downloads block
+DOWNLOAD_WORKERS = 3
+PIPELINE_QUEUE_SIZE = 4
+
 def get_platform_from_filename(filename):
     """
     Extracts platform string from filename based on known patterns.
@@ -33,18 +53,149 @@ def get_platform_from_filename(filename):
     # Default to generic python addon
     return 'all'
 
+def load_release_state(state_path=RELEASE_STATE_FILE):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if isinstance(state, dict):
+            return state
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable release state {state_path}: {e}")
+    return {}
+
+def save_release_state(state, state_path=RELEASE_STATE_FILE):
+    write_json_atomic(state_path, state)
+
+def get_asset_signature(asset):
+    """Fields of a release asset that change whenever its content changes."""
+    return {
+        'id': asset.get('id'),
+        'size': asset.get('size'),
+        'digest': asset.get('digest'),
+    }
+
+
+def run_command(cmd, stats=None):
+    """
+    Runs a shell command with captured output.
+    Its duration and exit code are appended to stats["commands"] if stats is given.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+    if stats is not None:
+        stats.setdefault("commands", []).append({
+            "command": cmd,
+            "wall_s": round(time.perf_counter() - start, 6),
+            "returncode": result.returncode,
+        })
+    return result
 
-def download_release(repo_url):
+class AssetRejected(Exception):
+    pass
+
+def inspect_asset(file_path):
+    """
+    Validates a downloaded asset before it is placed: the CRC of every member is checked
+    and the id is read from its addon.xml. Returns the addon id, or None if it has none.
+    Raises AssetRejected if the zip is broken.
+    """
+    try:
+        with AddonZip(file_path) as zf:
+            bad_member = zf.testzip()
+            if bad_member:
+                raise AssetRejected(f"CRC mismatch in {bad_member}")
+            content = zf.read_addon_xml()
+    except AssetRejected:
+        raise
+    except Exception as e:
+        raise AssetRejected(f"unreadable zip: {e}") from e
+
+    if not content:
+        return None
+    _, addon_id, _ = parse_addon_xml(content)
+    return addon_id
+
+def place_asset(asset, temp_dir, version, repo_state, log=print, stats=None):
+    """
+    Inspects a downloaded asset and moves it into its addon directory under the name
+    generate_repo.py expects, recording it in repo_state. Missing downloads are skipped.
+    """
+    filename = asset['name']
+    file_path = os.path.join(temp_dir, filename)
+    if not os.path.exists(file_path):
+        return
+
+    size = os.path.getsize(file_path)
+    count("assets_downloaded")
+    count("bytes_downloaded", size)
+    if stats is not None:
+        stats["assets_downloaded"] = stats.get("assets_downloaded", 0) + 1
+        stats["bytes_downloaded"] = stats.get("bytes_downloaded", 0) + size
+
+    try:
+        addon_id = inspect_asset(file_path)
+    except AssetRejected as e:
+        # Not recorded in the state, so the next run tries again
+        log(f"Rejected {filename}: {e}")
+        count("assets_rejected")
+        os.remove(file_path)
+        return
+
+    if not addon_id:
+        log(f"Could not find addon id in {filename}")
+        # Remember it anyway, so an unusable asset is not downloaded again on every run
+        repo_state['assets'][filename] = {'signature': get_asset_signature(asset), 'path': None}
+        return
+
+    # Determine platform and renaming strategy
+    platform = get_platform_from_filename(filename)
+
+    # Create addon directory
+    dest_dir = os.path.join(".", addon_id)
+    os.makedirs(dest_dir, exist_ok=True)
+
+    # Construct new filename
+    # For binary addons with specific platforms, we use the specific format
+    # For generic addons, we use the standard format
+    # generate_repo.py detects the platform from this name
+    if platform != 'all':
+        new_filename = f"{addon_id}-{version}-{platform}.zip"
+    else:
+        new_filename = f"{addon_id}-{version}.zip"
+
+    dest_path = os.path.join(dest_dir, new_filename)
+    log(f"Moving {filename} to {dest_path}")
+    shutil.move(file_path, dest_path)
+    repo_state['assets'][filename] = {'signature': get_asset_signature(asset), 'path': f"{addon_id}/{new_filename}"}
+    if stats is not None:
+        stats.setdefault("placed", []).append(dest_path)
+
+    # Old versions are cleaned up by prune_versions.py (main(keep=N)),
+    # which orders versions per addon and platform.
+
+def download_release(repo_url, log=print, state=None, stats=None):
+    """
+    Downloads the zip assets of the latest release of repo_url into their addon directories.
+    log receives every message, so concurrent runs can collect them per repo.
+    state is the release state loaded by load_release_state(). Assets whose tag, id, size
+    and digest match the state and whose file is still in place are not downloaded again.
+    The entry of this repo is updated in place.
+    stats, if given, receives the gh command durations and the downloaded assets and bytes.
+    Assets are inspected and placed as soon as they are downloaded, see place_asset().
+    """
+    temp_dir = None
     try:
         repo_name = repo_url.replace("https://github.com/", "").strip()
-        print(f"Checking {repo_name}...")
+        log(f"Checking {repo_name}...")
 
         # Use GH CLI to get latest release info
         cmd = f'gh release view --repo {repo_name} --json tagName,assets'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = run_command(cmd, stats)
         
         if result.returncode != 0:
-            print(f"Error checking release for {repo_name}: {result.stderr}")
+            log(f"Error checking release for {repo_name}: {result.stderr}")
             return
 
         data = json.loads(result.stdout)
@@ -62,94 +213,209 @@ def download_release(repo_url):
         else:
             version = tag_name.lstrip('v')
         
-        print(f"Latest version: {version}")
-
-        # Create temp directory
-        if not os.path.exists("temp_dl"):
-            os.makedirs("temp_dl")
+        log(f"Latest version: {version}")
 
-        # Download assets
-        cmd = f'gh release download {tag_name} --repo {repo_name} --pattern "*.zip" --dir temp_dl'
-        subprocess.run(cmd, shell=True, check=True)
+        # Compare with the previous run, only new or changed assets are downloaded
+        previous = (state or {}).get(repo_name, {})
+        previous_assets = previous.get('assets', {}) if previous.get('tag') == tag_name else {}
+        repo_state = {'tag': tag_name, 'assets': {}}
 
+        changed_assets = []
         for asset in assets:
             filename = asset['name']
             if not filename.endswith('.zip'):
                 continue
-                
-            file_path = os.path.join("temp_dl", filename)
-            if not os.path.exists(file_path):
-                continue
 
-            # Identify Addon ID from zip content
-            addon_id = None
+            known = previous_assets.get(filename)
+            signature = get_asset_signature(asset)
+            if known and known.get('signature') == signature and (known.get('path') is None or os.path.exists(known['path'])):
+                repo_state['assets'][filename] = known
+            else:
+                changed_assets.append(asset)
+
+        if not changed_assets:
+            log("No changes since last run, skipping download")
+            if state is not None:
+                state[repo_name] = repo_state
+            return
+
+        # Create a temp directory per repo, so concurrent downloads never share or delete each other's files.
+        # It lives in the repository root so moving assets into place is a rename.
+        temp_dir = tempfile.mkdtemp(prefix=".temp_dl-", dir=".")
+
+        # Downloads and inspection overlap: every finished asset is queued and validated and
+        # moved into place here while the others are still downloading. The queue is bounded,
+        # so downloads wait instead of piling up files when inspection falls behind.
+        ready = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        cancelled = threading.Event()
+
+        def hand_over(asset):
+            while not cancelled.is_set():
+                try:
+                    ready.put(asset, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+
+        def download(asset):
+            # Resumed with Range requests after a dropped connection, large assets in
+            # parallel ranges, and only kept if size and digest match the release
             try:
-                with zipfile.ZipFile(file_path, 'r') as zf:
-                    for name in zf.namelist():
-                        if name.endswith('addon.xml') and name.count('/') == 1:
-                            with zf.open(name) as f:
-                                content = f.read().decode('utf-8')
-                                match = re.search(r'id="([^"]+)"', content)
-                                if match:
-                                    addon_id = match.group(1)
-                                    break
+                result = download_file(asset['url'], os.path.join(temp_dir, asset['name']),
+                                       size=asset.get('size'), digest=asset.get('digest'), log=log)
+                if stats is not None:
+                    stats.setdefault("downloads", []).append(dict(name=asset['name'], **result))
+            except (DownloadError, requests.RequestException) as e:
+                log(f"Error downloading {asset['name']}: {e}")
             except Exception as e:
-                print(f"Error reading zip {filename}: {e}")
-                continue
+                # Nobody reads the future, e.g. a full disk would go unnoticed otherwise
+                log(f"Error saving {asset['name']}: {e}")
+            finally:
+                hand_over(asset)
 
-            if not addon_id:
-                print(f"Could not find addon id in {filename}")
-                continue
+        def download_with_gh(gh_assets):
+            # Assets without a download URL in the metadata go through gh, in one call
+            try:
+                patterns = " ".join(f'--pattern "{asset["name"]}"' for asset in gh_assets)
+                cmd = f'gh release download {tag_name} --repo {repo_name} {patterns} --dir {temp_dir}'
+                result = run_command(cmd, stats)
 
-            # Determine platform and renaming strategy
-            platform = get_platform_from_filename(filename)
-            
-            # Create addon directory
-            dest_dir = os.path.join(".", addon_id)
-            if not os.path.exists(dest_dir):
-                os.makedirs(dest_dir)
-
-            # Construct new filename
-            # For binary addons with specific platforms, we use the specific format
-            # For generic addons, we use the standard format
-            if platform != 'all':
-                new_filename = f"{addon_id}-{version}-{platform}.zip"
-            else:
-                new_filename = f"{addon_id}-{version}.zip"
-
-            dest_path = os.path.join(dest_dir, new_filename)
-            
-            # Custom handling for existing addon.xml to inject platform info if needed
-            # This logic will be handled by a modified generate_repo.py
-            # Here we just place the file
-            
-            # Logic: If platform specific, we need to create a marker file or 
-            # ensure generate_repo can detect it.
-            # We will rely on filename parsing in generate_repo.py
-
-            print(f"Moving {filename} to {dest_path}")
-            shutil.move(file_path, dest_path)
-            
-            # Clean up old versions?
-            # Ideally yes, but tricky to distinguish platform files vs versions. 
-            # For now, let's keep it simple and maybe cleanup later.
+                if result.returncode != 0:
+                    log(f"Error downloading release for {repo_name}: {result.stderr}")
+            except Exception as e:
+                log(f"Error downloading release for {repo_name}: {e}")
+            finally:
+                for asset in gh_assets:
+                    hand_over(asset)
 
-        # Clean up temp
-        shutil.rmtree("temp_dl")
+        gh_assets = [asset for asset in changed_assets if not asset.get('url')]
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            if gh_assets:
+                executor.submit(download_with_gh, gh_assets)
+            for asset in changed_assets:
+                if asset.get('url'):
+                    executor.submit(download, asset)
+
+            try:
+                # Every asset is handed over exactly once, downloaded or not
+                for _ in changed_assets:
+                    asset = ready.get()
+                    try:
+                        place_asset(asset, temp_dir, version, repo_state, log, stats)
+                    except Exception as e:
+                        log(f"Error placing {asset['name']}: {e}")
+            finally:
+                # Before the executor waits for the workers, which may be blocked in hand_over()
+                cancelled.set()
+
+        if state is not None:
+            state[repo_name] = repo_state
 
     except Exception as e:
-        print(f"Error processing {repo_url}: {e}")
+        log(f"Error processing {repo_url}: {e}")
+
+    finally:
+        # Clean up temp
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+def repack_zips(paths, compress_level=COMPRESS_LEVEL, jobs=None):
+    """
+    Repacks downloaded addon zips in a process pool, see zip_tools.repack_addon_zip().
+    A zip that fails to repack or verify is kept as downloaded.
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [(path, executor.submit(repack_addon_zip, path, compress_level)) for path in paths]
+        for path, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error repacking {path}, keeping it as downloaded: {e}")
+                continue
+            saved = result["size_before"] - result["size_after"]
+            if not saved:
+                print(f"Kept {path}, repacking does not make it smaller")
+                continue
+            count("zips_repacked")
+            count("bytes_saved", saved)
+            print(f"Repacked {path}: {result['size_before']} -> {result['size_after']} bytes"
+                  + (f", removed {len(result['removed'])} entries" if result["removed"] else ""))
+
+def main(concurrency=1, state_path=RELEASE_STATE_FILE, force=False, keep=None, report=None, repack=False, repack_level=COMPRESS_LEVEL):
+    if report is None:
+        report = BuildReport("update_repo")
 
-def main():
     if not os.path.exists('sources.txt'):
         print("sources.txt not found")
-        return
+        return report
 
     with open('sources.txt', 'r') as f:
         repos = [line.strip() for line in f if line.strip()]
 
-    for repo in repos:
-        download_release(repo)
+    # Each repo only writes its own key, so the state can be shared between threads
+    state = None
+    if state_path:
+        state = {} if force else load_release_state(state_path)
+
+    # Zips moved into place by this run, for --repack
+    placed = []
+
+    def fetch(repo, log=print):
+        stats = {}
+        start = time.perf_counter()
+        download_release(repo, log=log, state=state, stats=stats)
+        stats["wall_s"] = round(time.perf_counter() - start, 6)
+        placed.extend(stats.get("placed", []))
+        report.add_item(repo.replace("https://github.com/", "").strip(), stats)
+
+    with report.phase("releases"):
+        if concurrency > 1:
+            # Each repo logs into its own buffer which is printed as one block when it finishes,
+            # so output of concurrent repos does not interleave
+            print_lock = threading.Lock()
+
+            def fetch_buffered(repo):
+                lines = []
+                fetch(repo, log=lines.append)
+                with print_lock:
+                    print("\n".join(lines), flush=True)
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(fetch_buffered, repos))
+        else:
+            for repo in repos:
+                fetch(repo)
+
+    if repack and placed:
+        with report.phase("repack"):
+            repack_zips(placed, repack_level)
+
+    if state is not None:
+        # Drop repos that were removed from sources.txt
+        repo_names = set(repo.replace("https://github.com/", "").strip() for repo in repos)
+        with report.phase("save_state"):
+            save_release_state({k: v for k, v in state.items() if k in repo_names}, state_path)
+
+    if keep:
+        with report.phase("prune"):
+            prune_old_versions(keep)
+
+    return report
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download the latest release assets listed in sources.txt")
+    parser.add_argument("--concurrency", "-c", type=int, default=1, metavar="N", help="fetch up to N repos at the same time")
+    parser.add_argument("--force", action="store_true", help=f"ignore {RELEASE_STATE_FILE} and download every asset again")
+    parser.add_argument("--keep", type=int, metavar="N", help="afterwards delete all but the newest N versions per addon and platform")
+    parser.add_argument("--repack", action="store_true", help="rewrite downloaded zips without caches, VCS residue and nested zips, with images stored and everything else recompressed")
+    parser.add_argument("--repack-level", type=int, default=COMPRESS_LEVEL, choices=range(10), metavar="LEVEL", help=f"deflate level for --repack (default {COMPRESS_LEVEL})")
+    parser.add_argument("--report", metavar="FILE", help="write time per phase and per repo, gh command durations and download counters to FILE as JSON")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and write the stats to FILE (only the main thread with --concurrency)")
+    args = parser.parse_args()
+
+    report = BuildReport("update_repo")
+    with profiled(args.profile):
+        main(concurrency=args.concurrency, force=args.force, keep=args.keep, report=report,
+             repack=args.repack, repack_level=args.repack_level)
+    if args.report:
+        report.write(args.report)
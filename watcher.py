@@ -0,0 +1,218 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# Seconds without further changes before a burst of changes is handed over
+DEFAULT_DEBOUNCE = 0.3
+# Seconds between two scans of the polling fallback
+POLL_INTERVAL = 1.0
+
+# Returned among the changed paths when events were lost and everything has to be looked at again
+RESCAN = "."
+
+# inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def walk_directories(root, ignore):
+    """Yields root and every directory below it that ignore(relative path) doesn't exclude."""
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        yield directory
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False) and not ignore(os.path.relpath(entry.path, root)):
+                        pending.append(entry.path)
+        except OSError:
+            pass
+
+
+class InotifyWatcher:
+    """
+    Reports changed paths below root with Linux inotify, called through ctypes.
+    Every directory gets its own watch, directories created later are added as they appear.
+    """
+
+    kind = "inotify"
+
+    def __init__(self, root=".", ignore=None):
+        self.root = root
+        self.ignore = ignore or (lambda path: False)
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> directory
+        self._watches = {}
+        for directory in walk_directories(root, self.ignore):
+            self._add_watch(directory)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "Out of inotify watches, raise fs.inotify.max_user_watches")
+            # Removed again before we got to it
+            return
+        self._watches[wd] = directory
+
+    def read_changes(self, timeout=None):
+        """
+        Waits up to timeout seconds (None: forever) for events and returns the changed
+        paths, relative to root. Returns an empty set if nothing changed in time.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changes = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    changes.add(RESCAN)
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name) if name else directory
+                relative = os.path.relpath(path, self.root)
+                if relative == "." or self.ignore(relative):
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files created in it before the watch existed are picked up by the
+                    # processing of the directory itself
+                    for subdirectory in walk_directories(path, lambda p: self.ignore(os.path.relpath(os.path.join(path, p), self.root))):
+                        self._add_watch(subdirectory)
+                changes.add(relative)
+        return changes
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PollingWatcher:
+    """
+    Same interface as InotifyWatcher for systems without inotify: compares size and
+    mtime of every file below root every POLL_INTERVAL seconds.
+    """
+
+    kind = "polling"
+
+    def __init__(self, root=".", ignore=None, interval=POLL_INTERVAL):
+        self.root = root
+        self.ignore = ignore or (lambda path: False)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for directory in walk_directories(self.root, self.ignore):
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        relative = os.path.relpath(entry.path, self.root)
+                        if self.ignore(relative):
+                            continue
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        snapshot[relative] = (entry.is_dir(follow_symlinks=False), st.st_size, st.st_mtime_ns)
+            except OSError:
+                pass
+        return snapshot
+
+    def read_changes(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if remaining > 0:
+                time.sleep(remaining)
+            snapshot = self._scan()
+            changes = {path for path in snapshot.keys() | self._snapshot.keys()
+                       if snapshot.get(path) != self._snapshot.get(path)
+                       # A directory's mtime changes with its entries, those are reported themselves
+                       and not (snapshot.get(path, (False,))[0] and path in self._snapshot)}
+            self._snapshot = snapshot
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_watcher(root=".", ignore=None):
+    """InotifyWatcher where inotify is available, PollingWatcher otherwise."""
+    try:
+        return InotifyWatcher(root, ignore)
+    except (OSError, AttributeError) as e:
+        # AttributeError: libc without inotify_init1, e.g. on macOS
+        print(f"inotify not available ({e}), polling every {POLL_INTERVAL}s")
+        return PollingWatcher(root, ignore)
+
+
+def wait_for_changes(watcher, debounce=DEFAULT_DEBOUNCE):
+    """
+    Blocks until something changes, then keeps collecting until debounce seconds pass
+    without further changes, so an editor saving several files or a copy of a large zip
+    results in one update. Returns the changed paths.
+    """
+    changes = set()
+    while not changes:
+        changes = watcher.read_changes()
+    while True:
+        more = watcher.read_changes(debounce)
+        if not more:
+            return changes
+        changes |= more
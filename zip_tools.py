@@ -0,0 +1,321 @@
+import os
+import hashlib
+import mmap
+import shutil
+import struct
+import zipfile
+import zlib
+
+from build_report import count
+
+# Every entry gets the same timestamp and permissions, so a zip only depends on
+# the names and content of its inputs and rebuilding it gives identical bytes.
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+FILE_MODE = 0o644
+COMPRESS_LEVEL = 9
+
+# The zip comment records a digest of the inputs, which lets a later run tell
+# that an existing zip is already up to date without recompressing anything.
+DIGEST_PREFIX = b"inputs-sha256:"
+
+# Already compressed formats are stored, deflating them costs time and saves next to nothing
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.mp4', '.gz', '.xz', '.bz2')
+
+
+class _MappedFile:
+    """Read-only, seekable file object over an mmap, which is all zipfile needs."""
+
+    def __init__(self, mapped):
+        self._map = mapped
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        try:
+            self._map.seek(offset, whence)
+        except ValueError as e:
+            # Real files raise OSError here, which zipfile turns into BadZipFile
+            raise OSError(str(e)) from e
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def read(self, size=-1):
+        return self._map.read(size if size is not None and size >= 0 else None)
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def read_central_directory_crc(f):
+    """
+    CRC32 of the central directory of the zip in the binary file object f.
+    The central directory holds name, CRC and size of every member, so it changes
+    whenever the archive content changes, but only the tail of the file is read.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    # End of central directory record is 22 bytes plus an optional comment of up to 64 KB
+    tail_size = min(file_size, 22 + 0xFFFF)
+    f.seek(file_size - tail_size)
+    tail = f.read(tail_size)
+
+    eocd = tail.rfind(b"PK\x05\x06")
+    if eocd < 0 or len(tail) - eocd < 22:
+        raise zipfile.BadZipFile("End of central directory not found")
+
+    cd_size, cd_offset = struct.unpack("<II", tail[eocd + 12:eocd + 20])
+    if cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        # Zip64 archive, let zipfile locate the central directory
+        crc = 0
+        for info in zipfile.ZipFile(f).infolist():
+            crc = zlib.crc32(f"{info.filename}:{info.CRC}:{info.file_size}\n".encode("utf-8"), crc)
+        return crc
+
+    f.seek(cd_offset)
+    return zlib.crc32(f.read(cd_size))
+
+
+class AddonZip:
+    """
+    Read access to an addon zip, shared by generate_repo.py and update_repo.py.
+
+    The central directory is parsed once into a name -> ZipInfo dict, so member
+    lookups are O(1) instead of scanning namelist(), and all members are read
+    through one file handle, memory mapped where the platform allows it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = None
+        try:
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._source = _MappedFile(self._map)
+            except (ValueError, OSError):
+                # Empty files and some file systems can't be mapped
+                self._source = self._file
+            self._zf = zipfile.ZipFile(self._source, "r")
+        except Exception:
+            self.close()
+            raise
+        self.infos = {info.filename: info for info in self._zf.infolist()}
+        count("zips_opened")
+        self.root_folder = self._find_root_folder()
+
+    def _find_root_folder(self):
+        """
+        The folder holding the root addon.xml, e.g. "plugin.video.foo/", or None.
+        Addon zips normally start with entries of that folder, so the first entry's
+        top level folder is checked first and a full scan is only the fallback.
+        """
+        for name in self.infos:
+            top = name.split("/", 1)[0] + "/"
+            if top + "addon.xml" in self.infos:
+                return top
+            break
+
+        for name in self.infos:
+            if name.endswith("/addon.xml") and name.count("/") == 1:
+                return name[:-len("addon.xml")]
+        return None
+
+    def __contains__(self, name):
+        return name in self.infos
+
+    def getinfo(self, name):
+        return self.infos[name]
+
+    def open(self, name_or_info):
+        info = name_or_info if isinstance(name_or_info, zipfile.ZipInfo) else self.infos[name_or_info]
+        count("bytes_inflated", info.file_size)
+        return self._zf.open(info)
+
+    def read(self, name_or_info):
+        data = self._zf.read(name_or_info)
+        count("bytes_inflated", len(data))
+        return data
+
+    def read_addon_xml(self):
+        """Decoded content of the root addon.xml, or None if there is none."""
+        if not self.root_folder:
+            return None
+        return self.read(self.root_folder + "addon.xml").decode("utf-8")
+
+    def central_directory_crc(self):
+        return read_central_directory_crc(self._source)
+
+    def testzip(self):
+        return self._zf.testzip()
+
+    def close(self):
+        zf = getattr(self, "_zf", None)
+        if zf is not None:
+            zf.close()
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def is_excluded_path(arcname):
+    """
+    Whether an archive path is left out of addon zips: VCS and editor residue (any path
+    component starting with "."), Python caches and zips nested in the addon tree.
+    """
+    return any(part.startswith(".") or part == "__pycache__" for part in arcname.split("/")) \
+        or arcname.endswith((".pyc", ".pyo", ".zip"))
+
+
+def get_compress_type(arcname):
+    return zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+
+
+def open_source(source):
+    """Binary file object for an entry source: the path of a file or a callable returning one."""
+    return source() if callable(source) else open(source, "rb")
+
+
+def get_inputs_digest(entries):
+    """
+    SHA-256 over the sorted archive names and the content of every entry.
+    entries maps the archive name to bytes, the path of a source file or a callable
+    returning a binary file object, e.g. a member of another zip.
+    """
+    digest = hashlib.sha256()
+    for arcname in sorted(entries):
+        source = entries[arcname]
+        content = hashlib.sha256()
+        if isinstance(source, bytes):
+            content.update(source)
+        else:
+            with open_source(source) as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    content.update(chunk)
+        digest.update(arcname.encode("utf-8") + b"\0" + content.digest())
+    return digest.hexdigest()
+
+
+def get_zip_digest(zip_path):
+    """Returns the inputs digest stored in the comment of zip_path, or None."""
+    try:
+        with zipfile.ZipFile(zip_path, "r") as zf:
+            comment = zf.comment
+    except (OSError, zipfile.BadZipFile):
+        return None
+    if comment.startswith(DIGEST_PREFIX):
+        return comment[len(DIGEST_PREFIX):].decode("ascii", "replace")
+    return None
+
+
+def make_zip_info(arcname, compress_type=zipfile.ZIP_DEFLATED, compress_level=COMPRESS_LEVEL):
+    info = zipfile.ZipInfo(arcname, date_time=FIXED_DATE_TIME)
+    info.compress_type = compress_type
+    # Also used by ZipFile.open(info, "w"), which ignores the level of the ZipFile
+    info._compresslevel = compress_level
+    # Same host system and permissions everywhere, including builds on Windows
+    info.create_system = 3
+    info.external_attr = (0o100000 | FILE_MODE) << 16
+    return info
+
+
+def write_deterministic_zip(output, entries, digest=None, compress_level=COMPRESS_LEVEL):
+    """
+    Writes entries (archive name -> bytes, source path or callable, see get_inputs_digest())
+    to output, a path or a writable file object, in sorted order with fixed timestamps and
+    permissions. Images and other compressed formats are stored, the rest is deflated.
+    """
+    if digest is None:
+        digest = get_inputs_digest(entries)
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zf:
+        for arcname in sorted(entries):
+            source = entries[arcname]
+            info = make_zip_info(arcname, get_compress_type(arcname), compress_level)
+            if isinstance(source, bytes):
+                zf.writestr(info, source)
+            else:
+                # Stream files so large inputs are never held in memory
+                with open_source(source) as src, zf.open(info, "w") as dest:
+                    shutil.copyfileobj(src, dest, 1024 * 1024)
+        zf.comment = DIGEST_PREFIX + digest.encode("ascii")
+    return digest
+
+
+def build_zip(output_zip, entries, publisher=None):
+    """
+    Builds output_zip from entries unless the existing zip was built from the same inputs.
+    With a publisher the new zip is staged, otherwise it is written to a hidden temp file
+    and renamed into place.
+    Returns (digest, built).
+    """
+    digest = get_inputs_digest(entries)
+    if get_zip_digest(publisher.resolve(output_zip) if publisher else output_zip) == digest:
+        count("zips_unchanged")
+        return digest, False
+
+    count("zips_built")
+    if publisher:
+        # Counted as written when the publisher commits it
+        write_deterministic_zip(publisher.stage_path(output_zip), entries, digest)
+    else:
+        temp_zip = os.path.join(os.path.dirname(output_zip), "." + os.path.basename(output_zip) + ".tmp")
+        write_deterministic_zip(temp_zip, entries, digest)
+        count("bytes_written", os.path.getsize(temp_zip))
+        os.replace(temp_zip, output_zip)
+    return digest, True
+
+
+def repack_addon_zip(zip_path, compress_level=COMPRESS_LEVEL):
+    """
+    Rewrites a downloaded addon zip without the entries is_excluded_path() rejects, as a
+    deterministic zip with images stored and everything else deflated at compress_level.
+    The result replaces zip_path only if it is smaller, passed a CRC test and carries a
+    byte identical addon.xml. A zip repacked before from the same entries is left alone.
+    Returns {"size_before", "size_after", "removed"}, size_after is size_before if the
+    original was kept.
+    """
+    temp_zip = os.path.join(os.path.dirname(zip_path), "." + os.path.basename(zip_path) + ".repack.tmp")
+    size_before = os.path.getsize(zip_path)
+    try:
+        with AddonZip(zip_path) as source:
+            if source.root_folder is None:
+                raise ValueError(f"{zip_path} has no addon.xml")
+            addon_xml_name = source.root_folder + "addon.xml"
+            addon_xml = source.read(addon_xml_name)
+
+            entries = {}
+            removed = []
+            for name, info in source.infos.items():
+                if info.is_dir():
+                    continue
+                if is_excluded_path(name):
+                    removed.append(name)
+                    continue
+                entries[name] = lambda info=info: source.open(info)
+
+            digest = get_inputs_digest(entries)
+            if not removed and get_zip_digest(zip_path) == digest:
+                return {"size_before": size_before, "size_after": size_before, "removed": []}
+            write_deterministic_zip(temp_zip, entries, digest, compress_level)
+
+        # Stored images can outweigh what was removed when upstream deflated them well
+        if os.path.getsize(temp_zip) >= size_before:
+            return {"size_before": size_before, "size_after": size_before, "removed": []}
+
+        with AddonZip(temp_zip) as repacked:
+            if repacked.testzip() is not None or addon_xml_name not in repacked \
+                    or repacked.read(addon_xml_name) != addon_xml:
+                raise ValueError(f"Repacked {zip_path} does not match the original")
+        os.replace(temp_zip, zip_path)
+    finally:
+        if os.path.exists(temp_zip):
+            os.remove(temp_zip)
+    return {"size_before": size_before, "size_after": os.path.getsize(zip_path), "removed": removed}